@@ -1,9 +1,17 @@
 import streamlit as st
 import uuid
 import os
+import time
 import requests
-from client import ChatClient
-from auth import AuthManager
+from datetime import datetime, timedelta
+from client import ChatClient, CancelToken
+from models import ALL_MODELS
+from render import ThrottledRenderer
+from scheduler import get_scheduler, priority_for, QueueFull
+from usage import QuotaExceeded, daily_quota
+import metrics
+from auth import get_auth
+from storage import ANONYMOUS
 from streamlit_oauth import OAuth2Component
 
 st.set_page_config(layout="wide")
@@ -72,7 +80,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- Authentication setup ---
-auth = AuthManager()
+auth = get_auth()
 if "user" not in st.session_state:
     st.session_state.user = None
 if "show_login" not in st.session_state:
@@ -85,6 +93,8 @@ GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8501")
 GOOGLE_AUTHORIZATION_BASE_URL = "https://accounts.google.com/o/oauth2/v2/auth"
 GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
 GOOGLE_SCOPE = "https://www.googleapis.com/auth/userinfo.email"
+# Users who see the usage admin view, e.g. "ops@example.com,alice@example.com"
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
 google_oauth = OAuth2Component(
     GOOGLE_CLIENT_ID,
     GOOGLE_CLIENT_SECRET,
@@ -125,13 +135,6 @@ def render_bubble(message: str, role: str):
         """, unsafe_allow_html=True)
 
 # --- 3. Sidebar & model config ---
-ALL_MODELS = {
-    "LLaMA 3.2 3B":    {"name": "llama3.2:3b", "ram": "2.0 GB",  "supports_think": False},
-    "LLaMA 3.1 8B":    {"name": "llama3.1:8b", "ram": "4.9 GB",  "supports_think": False},
-    "Qwen 3 14B":      {"name": "qwen3:14b",  "ram": "9.3 GB",  "supports_think": True},
-    "DeepSeek R1 70B": {"name": "deepseek-r1:70b","ram":"42 GB","supports_think": True},
-    "LLaMA 3.1 70B":   {"name": "llama3.1:70b","ram":"39 GB",   "supports_think": False},
-}
 MODELS = ALL_MODELS if st.session_state.user else {"LLaMA 3.2 3B": ALL_MODELS["LLaMA 3.2 3B"]}
 st.sidebar.title("**Choose a model:**")
 selected = st.sidebar.selectbox("", list(MODELS.keys()))
@@ -157,24 +160,79 @@ with st.sidebar.expander("Adjust hyperparameters", expanded=False):
     p["top_k"]          = st.slider("Top-k", 0, 200, p["top_k"])
 
 # --- 5. Initialize client & sessions ---
+# Per session for its params; storage, pool and caches underneath are process-wide
 if "chat_client" not in st.session_state:
     st.session_state.chat_client = ChatClient()
 client = st.session_state.chat_client
 client.params = st.session_state.params
 
+# Any rerun (navigation, a new submit, a widget change) abandons a generation
+# still streaming from the previous run: stop it on the backend. Its partial
+# answer is saved by stream_message.
+if (gen := st.session_state.pop("generation", None)) is not None:
+    gen.cancel("rerun")
+
+# Expected latency for the selected model, from what the backends have loaded
+load_secs = client.residency.expected_load_secs(model_name)
+if load_secs:
+    st.sidebar.caption(f"{selected} is not loaded; expect ~{load_secs:.0f} s extra for the first reply.")
+else:
+    st.sidebar.caption(f"{selected} is loaded.")
+
+# Prometheus endpoint / metrics file, if METRICS_PORT / METRICS_FILE are set
+metrics.start_exporter()
+
+@st.cache_resource
+def start_search_backfill():
+    # Once per process: index messages that predate the search index
+    return client.storage.start_search_backfill()
+
+start_search_backfill()
+
 st.sidebar.title("Chats")
+search_q = st.sidebar.text_input("Search chats", key="search_q")
+if search_q.strip():
+    results, _ = client.storage.search_messages(search_q, st.session_state.user, limit=10)
+    if not results:
+        st.sidebar.caption("No matches")
+    for r in results:
+        if st.sidebar.button(f"{r['title'] or 'Chat'}: {r['snippet']}", key=f"search_{r['msg_id']}"):
+            st.session_state.current_chat = r["chat_id"]
+# Chats belong to the logged-in user; logged-out visitors share the anonymous owner
+owner = st.session_state.user
+# Token usage is billed to the logged-in user; logged-out visitors share one
+# anonymous pool, since a per-session key would reset with every new tab
+requester = st.session_state.user or ANONYMOUS
+# Scheduling limits are per person: anonymous visitors per browser session
+if "anon_id" not in st.session_state:
+    st.session_state.anon_id = "anon:" + str(uuid.uuid4())
 if st.sidebar.button("+ New Chat"):
     new_id = str(uuid.uuid4())
-    client.storage.create_chat(new_id)
+    client.storage.create_chat(new_id, owner)
     st.session_state.current_chat = new_id
 
+CHAT_PAGE = 30
+if "chat_limit" not in st.session_state:
+    st.session_state.chat_limit = CHAT_PAGE
+
 sidebar_radio_ph = st.sidebar.empty()
-chats = client.storage.list_chats()
+chats = client.storage.list_chats(owner, st.session_state.chat_limit)
 if not chats:
     new_id = str(uuid.uuid4())
-    client.storage.create_chat(new_id)
+    client.storage.create_chat(new_id, owner)
     st.session_state.current_chat = new_id
-    chats = client.storage.list_chats()
+    chats = client.storage.list_chats(owner, st.session_state.chat_limit)
+if len(chats) < client.storage.count_chats(owner) and st.sidebar.button("Show older chats"):
+    _, last_created, _ = chats[-1]
+    chats += client.storage.list_chats(owner, CHAT_PAGE, cursor=(last_created, chats[-1][0]))
+    st.session_state.chat_limit = len(chats)
+# A chat opened from search may be older than the pages loaded so far; list it
+# too, or the radio below would fall back to the newest chat
+current = st.session_state.get("current_chat")
+if current and current not in {c for c,_,_ in chats}:
+    row = client.storage.get_chat(current, owner)
+    if row:
+        chats.append(row)
 ids   = [c for c,_,_ in chats]
 names = [t or "Chat" for _,_,t in chats]
 idx = sidebar_radio_ph.radio(
@@ -192,11 +250,6 @@ if initial_title:
     title_ph.markdown(f"## {initial_title}")
 
 
-# --- Layout: chat on left, placeholder column on right ---
-left_col, right_col = st.columns([4, 1])
-
-# --- Login/Register controls at top of sidebar ---
-with st.sidebar:
 # --- Layout: chat on left, login sidebar on right ---
 left_col, right_col = st.columns([4, 1])
 
@@ -213,6 +266,24 @@ with right_col:
         if st.button("Make Account", key="register_btn"):
             st.session_state.show_register = True
 
+    quota = daily_quota(requester)
+    if quota:
+        st.caption(f"Today: {client.storage.tokens_used(requester):,} of {quota:,} tokens")
+
+    # --- Usage admin view ---
+    if st.session_state.user in ADMIN_USERS:
+        with st.expander("Usage", expanded=False):
+            days = st.selectbox("Period", (1, 7, 30), format_func=lambda d: "Today" if d == 1 else f"Last {d} days",
+                                key="usage_days")
+            since = (datetime.utcnow().date() - timedelta(days=days - 1)).isoformat()
+            for by, label in ((("owner",), "By user"), (("model",), "By model"), (("day",), "By day")):
+                rows = client.storage.usage_report(since, by=by)
+                st.markdown(f"**{label}**")
+                if rows:
+                    st.dataframe(rows, use_container_width=True, hide_index=True)
+                else:
+                    st.caption("No usage")
+
 st.sidebar.markdown("---")
 st.sidebar.markdown("<p style='text-align:center; font-size: 32px;'>\U0001F464</p>", unsafe_allow_html=True)
 
@@ -273,20 +344,43 @@ if st.session_state.show_register:
 # Use a container inside the left column for chat history
 chat_container = left_col.container()
 
+HISTORY_PAGE = 40
+
+# Per chat: the loaded window of (msg_id, role, text). Reasoning text is None
+# until its expander is opened; msg_id is None for turns streamed this session.
 if "history" not in st.session_state:
     st.session_state.history = {}
 if cid not in st.session_state.history:
-    msgs = client.storage.fetch_history(cid)
-    st.session_state.history[cid] = [(m['role'], m['content']) for m in msgs]
-history = st.session_state.history[cid]
+    msgs = client.storage.fetch_history_page(cid, HISTORY_PAGE, include_reasoning=False)
+    st.session_state.history[cid] = {
+        "msgs": [(m["msg_id"], m["role"], m["content"]) for m in msgs],
+        "more": len(msgs) == HISTORY_PAGE,
+    }
+view    = st.session_state.history[cid]
+history = view["msgs"]
+
+def load_earlier():
+    oldest = next((i for i, _, _ in history if i is not None), None)
+    older  = client.storage.fetch_history_page(cid, HISTORY_PAGE, before=oldest, include_reasoning=False)
+    history[:0] = [(m["msg_id"], m["role"], m["content"]) for m in older]
+    view["more"] = len(older) == HISTORY_PAGE
+
+def load_reasoning(pos: int, msg_id: int):
+    history[pos] = (msg_id, "assistant_think", client.storage.fetch_message(msg_id) or "")
 
 def draw_history():
     chat_container.empty()
     with chat_container:
-        for role, text in history:
+        if view["more"]:
+            st.button("Load earlier messages", key=f"earlier_{cid}", on_click=load_earlier)
+        for pos, (msg_id, role, text) in enumerate(history):
             if role == "assistant_think":
-                with st.expander("Thinking…", expanded=False):
-                    render_bubble(text, role)
+                with st.expander("Thinking…", expanded=text is not None and msg_id is not None):
+                    if text is None:
+                        st.button("Show reasoning", key=f"think_{msg_id}",
+                                  on_click=load_reasoning, args=(pos, msg_id))
+                    else:
+                        render_bubble(text, role)
             else:
                 render_bubble(text, role)
 
@@ -302,56 +396,94 @@ else:
     user_input = ""
     send = False
 
+def show_title(new_title: str):
+    title_ph.markdown(f"## {new_title}")
+    names[ids.index(cid)] = new_title
+    sidebar_radio_ph.radio(
+        "Select Session", list(range(len(ids))),
+        format_func=lambda i: names[i],
+        index=ids.index(cid)
+    )
+
 if send and user_input:
-    history.append(("user", user_input))
+    # The first turn of a chat gets a title from the background title worker
+    awaiting_title = not history and not initial_title
+    history.append((None, "user", user_input))
     with chat_container:
         render_bubble(user_input, "user")
 
     with chat_container:
         if supports_think:
             think_exp = st.expander("Thinking…", expanded=False)
-            think_ph  = think_exp.empty()
-        answer_ph = st.empty()
-
-    thinking_text = ""
-    answer_text   = ""
-    title_updated = False
-
-    for chunk in client.stream_message(cid, user_input, model_name):
-        # update title if needed
-        if not title_updated:
-            new_title = client.storage.get_chat_title(cid) or "Chat"
-            if new_title != initial_title:
-                title_ph.markdown(f"## {new_title}")
-                chats = client.storage.list_chats()
-                ids   = [c for c,_,_ in chats]
-                names = [t or "Chat" for _,_,t in chats]
-                idx = sidebar_radio_ph.radio(
-                    "Select Session", list(range(len(ids))),
-                    format_func=lambda i: names[i],
-                    index=ids.index(cid)
-                )
-                st.session_state.current_chat = ids[idx]
-            title_updated = True
-
-        # unpack chunk
-        ctype = chunk.get("type", "answer") if isinstance(chunk, dict) else "answer"
-        text  = chunk.get("text", "")      if isinstance(chunk, dict) else chunk
-
-        if ctype == "think" and supports_think:
-            thinking_text += text
-            think_ph.markdown(
-                f"<div class='bubble bot_thinking'>{thinking_text}</div>",
-                unsafe_allow_html=True
-            )
-        else:
-            answer_text += text
-            answer_ph.markdown(
-                f"<div class='bubble bot'>{answer_text}</div>",
-                unsafe_allow_html=True
-            )
-
-    history.append(("assistant_think", thinking_text))
-    history.append(("assistant", answer_text))
+            think_r   = ThrottledRenderer(think_exp.empty(), "<div class='bubble bot_thinking'>{}</div>")
+        answer_r = ThrottledRenderer(st.empty(), "<div class='bubble bot'>{}</div>")
+
+    queue_ph = chat_container.empty()
+    cancel = st.session_state.generation = CancelToken()
+    stream = client.stream_message(cid, user_input, model_name, cancel=cancel, user=requester)
+    try:
+        # Refuse before queueing; stream_message checks again before sending
+        client.check_quota(cid, requester)
+        with get_scheduler().slot(
+            model_name,
+            user=st.session_state.user or st.session_state.anon_id,
+            priority=priority_for(bool(st.session_state.user)),
+            on_wait=lambda pos: queue_ph.info(f"Waiting for {selected}: position {pos} in queue"),
+        ):
+            queue_ph.empty()
+            render_t0 = time.perf_counter()
+            for chunk in stream:
+                # title arrives once, from the background title worker
+                if isinstance(chunk, dict) and chunk.get("type") == "title":
+                    show_title(chunk["text"])
+                    awaiting_title = False
+                    continue
+
+                # unpack chunk
+                ctype = chunk.get("type", "answer") if isinstance(chunk, dict) else "answer"
+                text  = chunk.get("text", "")      if isinstance(chunk, dict) else chunk
+
+                if ctype == "think" and supports_think:
+                    think_r.add(text)
+                else:
+                    answer_r.add(text)
+    except (QueueFull, QuotaExceeded) as e:
+        # Rejected before anything was sent or stored
+        queue_ph.error(str(e))
+        history.pop()
+        st.stop()
+    except BaseException:
+        # Streamlit interrupts the script (rerun, tab closed) by raising from
+        # the next st.* call: stop the backend and save the partial answer now,
+        # and reload this chat from the database on the next run
+        cancel.cancel("interrupted")
+        stream.close()
+        st.session_state.history.pop(cid, None)
+        raise
+    st.session_state.pop("generation", None)
+
+    # Final frame, whatever the throttle
+    if supports_think:
+        think_r.flush()
+    answer_r.flush()
+    metrics.SPAN_SECONDS.observe(time.perf_counter() - render_t0, span="render_loop")
+    metrics.RENDER_FRAMES.inc(answer_r.frames + (think_r.frames if supports_think else 0))
+
+    # A title finishing after the last delta (short reply, cached replay) is
+    # never yielded by the stream. Check storage once; one still queued is
+    # stored when done and shown on the next rerun, without blocking this one
+    if awaiting_title and (late_title := client.storage.get_chat_title(cid)) is not None:
+        show_title(late_title)
+
+    if supports_think and think_r.text:
+        history.append((None, "assistant_think", think_r.text))
+    history.append((None, "assistant", answer_r.text))
+
+    ctx = client.last_context_stats
+    if ctx and ctx["dropped_messages"]:
+        chat_container.caption(
+            f"Context: sent {ctx['sent_tokens']} tokens, "
+            f"dropped {ctx['dropped_tokens']} ({ctx['dropped_messages']} older messages)"
+        )
 
 # right_col is left empty for future use
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import time
+from typing import AsyncGenerator, Dict
+import aiohttp
+from client import ChatClient, CancelToken, COMPLETIONS_PATH, parse_sse_delta, parse_sse_usage, token_counts
+from think_parser import ThinkParser
+from cache import replay
+
+ASYNC_POOL_LIMIT     = int(os.getenv("OLLAMA_ASYNC_POOL_LIMIT", "100"))
+ASYNC_KEEPALIVE_SECS = float(os.getenv("OLLAMA_ASYNC_KEEPALIVE", "60"))
+
+
+class AsyncChatClient(ChatClient):
+    """
+    asyncio variant of ChatClient for multiplexing many generations on one worker.
+
+    stream_message has the same contract as ChatClient.stream_message
+    ({'type': 'think' | 'answer' | 'title', 'text': ...}) but is an async generator.
+    SQLite calls are pushed to the default executor so commits never stall
+    the event loop. Use as `async with AsyncChatClient() as client:`.
+    """
+    def __init__(self, url: str = "http://127.0.0.1:11434",
+                 limit: int = ASYNC_POOL_LIMIT, keepalive: float = ASYNC_KEEPALIVE_SECS):
+        super().__init__(url)
+        self._limit     = limit
+        self._keepalive = keepalive
+        self._session   = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def _http(self) -> aiohttp.ClientSession:
+        # Created lazily so the session binds to the running loop.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._limit, keepalive_timeout=self._keepalive)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=300, sock_connect=10),
+            )
+        return self._session
+
+    async def _stream_deltas_async(self, payload: dict, cancel: CancelToken,
+                                   usage: dict = None) -> AsyncGenerator[str, None]:
+        """Async twin of ChatClient._stream_deltas, sharing the same response cache."""
+        key = self._cache_key(payload)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                for delta in replay(cached):
+                    if cancel.cancelled:
+                        return
+                    yield delta
+                return
+        parts = []
+        loop = asyncio.get_running_loop()
+        # Same routing as the sync client: least-loaded healthy backend for the model
+        with self.pool.lease(payload["model"]) as backend:
+            async with self._http().post(backend.url + COMPLETIONS_PATH, json=payload) as r:
+                # cancel() may come from another thread; the response belongs to this loop
+                cancel.on_cancel(lambda: loop.call_soon_threadsafe(r.close))
+                r.raise_for_status()
+                if usage is not None:
+                    usage["model"] = payload["model"]
+                try:
+                    # aiohttp yields raw lines including the trailing newline
+                    async for line in r.content:
+                        if cancel.cancelled:
+                            return
+                        line = line.rstrip(b"\r\n")
+                        delta = parse_sse_delta(line)
+                        if not delta:
+                            if usage is not None:
+                                usage.update(token_counts(parse_sse_usage(line)))
+                            continue
+                        if key:
+                            parts.append(delta)
+                        yield delta
+                except aiohttp.ClientError:
+                    if not cancel.cancelled:
+                        raise
+        if key and not cancel.cancelled:
+            self.cache.put(key, "".join(parts))
+
+    async def stream_message(self, chat_id: str, prompt: str, model: str,
+                             cancel: CancelToken = None, user: str = None) -> AsyncGenerator[Dict[str, str], None]:
+        storage = self.storage
+        await asyncio.to_thread(self.check_quota, chat_id, user)
+        await asyncio.to_thread(storage.append_message, chat_id, "user", prompt)
+        history = await asyncio.to_thread(storage.fetch_history, chat_id, self.context.include_reasoning)
+
+        # Title runs on the shared background executor, same as ChatClient
+        title_future = self.titles.submit(chat_id, prompt) if len(history) == 1 else None
+
+        # Stats stay local: self.last_context_stats is shared by every stream on this client
+        messages, stats = self._build_messages(history, model)
+        payload  = self._payload(model, messages, stream=True)
+        parser   = ThinkParser()
+
+        cancel   = cancel or CancelToken()
+        finished = False
+        usage, received, started = {}, 0, time.perf_counter()
+        with storage.maintenance.streaming():
+            try:
+                async for delta in self._stream_deltas_async(payload, cancel, usage):
+                    received += len(delta)
+                    if title_future is not None and title_future.done():
+                        title, title_future = title_future.result(), None
+                        yield {"type": "title", "text": title}
+                    for kind, text in parser.feed(delta):
+                        if kind == "think_end":
+                            await asyncio.to_thread(storage.append_message, chat_id, "assistant_think",
+                                                    parser.reasoning.strip())
+                            parser.reset_reasoning()
+                        else:
+                            yield {"type": kind, "text": text}
+
+                events = parser.flush()
+                if not cancel.cancelled:
+                    for kind, text in events:
+                        yield {"type": kind, "text": text}
+                    finished = True
+            except (GeneratorExit, asyncio.CancelledError):
+                cancel.cancel("abandoned")
+                raise
+            finally:
+                # Same rule as ChatClient.stream_message; a plain call, as a closing generator cannot await
+                if finished or cancel.cancelled or parser.answer or parser.reasoning:
+                    self._persist_reply(chat_id, parser, truncated=not finished,
+                                        usage=self._reply_usage(usage, started, stats["sent_tokens"], received, user))
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+        self.close()
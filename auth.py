@@ -1,39 +1,37 @@
 import sqlite3
-import os
 import hashlib
+import threading
 from datetime import datetime
-
-DB_FILE = os.getenv("CHAT_DB_PATH", "chat_history.db")
+from db import get_database
 
 class AuthManager:
-    """Simple local authentication using SQLite."""
+    """Simple local authentication using SQLite (the process-wide Database from db.py)."""
     def __init__(self, db_path: str = None):
-        self.db_path = db_path or DB_FILE
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db = get_database(db_path)
+        self.db_path = self.db.path
         self._init_db()
 
     def _init_db(self):
-        c = self.conn.cursor()
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                username TEXT PRIMARY KEY,
-                password TEXT,
-                created_at TEXT
-            );
-            """
-        )
-        self.conn.commit()
+        with self.db.write() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    password TEXT,
+                    created_at TEXT
+                );
+                """
+            )
 
     def create_user(self, username: str, password: str) -> bool:
         """Create a new user. Returns True if created."""
         hashed = hashlib.sha256(password.encode()).hexdigest()
         try:
-            self.conn.execute(
-                "INSERT INTO users(username, password, created_at) VALUES(?,?,?)",
-                (username, hashed, datetime.utcnow().isoformat()),
-            )
-            self.conn.commit()
+            with self.db.write() as conn:
+                conn.execute(
+                    "INSERT INTO users(username, password, created_at) VALUES(?,?,?)",
+                    (username, hashed, datetime.utcnow().isoformat()),
+                )
             return True
         except sqlite3.IntegrityError:
             return False
@@ -41,7 +39,7 @@ class AuthManager:
     def validate_user(self, username: str, password: str) -> bool:
         """Validate a username/password combination."""
         hashed = hashlib.sha256(password.encode()).hexdigest()
-        c = self.conn.cursor()
+        c = self.db.reader().cursor()
         c.execute(
             "SELECT password FROM users WHERE username=?",
             (username,),
@@ -51,14 +49,14 @@ class AuthManager:
 
     def change_password(self, username: str, new_password: str) -> None:
         hashed = hashlib.sha256(new_password.encode()).hexdigest()
-        self.conn.execute(
-            "UPDATE users SET password=? WHERE username=?",
-            (hashed, username),
-        )
-        self.conn.commit()
+        with self.db.write() as conn:
+            conn.execute(
+                "UPDATE users SET password=? WHERE username=?",
+                (hashed, username),
+            )
 
     def user_exists(self, username: str) -> bool:
-        c = self.conn.cursor()
+        c = self.db.reader().cursor()
         c.execute(
             "SELECT 1 FROM users WHERE username=?",
             (username,),
@@ -72,3 +70,16 @@ class AuthManager:
             random_pw = secrets.token_hex(16)
             self.create_user(email, random_pw)
         return True
+
+
+_auth = None
+_auth_lock = threading.Lock()
+
+
+def get_auth() -> AuthManager:
+    """Process-wide AuthManager on the default database."""
+    global _auth
+    with _auth_lock:
+        if _auth is None:
+            _auth = AuthManager()
+        return _auth
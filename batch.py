@@ -0,0 +1,179 @@
+"""
+Offline batch inference over JSONL, through the same ChatClient stack as the app.
+
+Each input line is a JSON object with either "prompt" (a string) or
+"messages" (a chat message list), plus optional "id", "model" and "system".
+Each output line carries the input's "index" (0-based line number) and
+"id" with "answer" and "reasoning" (split out of <think>), or "error".
+
+    python batch.py prompts.jsonl --out results.jsonl --concurrency 8
+    cat prompts.jsonl | python batch.py --model qwen3:14b --order completion > results.jsonl
+
+The output file doubles as the checkpoint: with --resume, lines already
+answered there are skipped, failed ones are retried, and new results are
+appended, so a killed job picks up where it stopped. Input is read lazily;
+at most --concurrency prompts are in flight over the shared connection pool.
+Throughput (prompts/min) is reported on stderr.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "llama3.2:3b"
+
+
+def load_checkpoint(path: str) -> set:
+    """
+    Indices already answered in the output file at `path`. Rewrites the file
+    without failed records and without a torn last line, so it can be appended to.
+    """
+    if not os.path.exists(path):
+        return set()
+    done, kept = set(), []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn write from a killed run
+            if "error" not in record:
+                done.add(record["index"])
+                kept.append(line if line.endswith("\n") else line + "\n")
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.writelines(kept)
+    os.replace(tmp, path)
+    return done
+
+
+def to_messages(item: dict) -> list:
+    if "messages" in item:
+        return item["messages"]
+    messages = [{"role": "system", "content": item["system"]}] if item.get("system") else []
+    return messages + [{"role": "user", "content": item["prompt"]}]
+
+
+class BatchRunner:
+    """
+    Runs prompts through ChatClient.complete with bounded concurrency.
+
+    order="input" writes results in input order (holding back finished ones
+    until their predecessors are written); order="completion" writes each as
+    soon as it finishes.
+    """
+    def __init__(self, client, model: str = DEFAULT_MODEL, concurrency: int = 4, order: str = "input",
+                 progress_every: float = 0):
+        self.client      = client
+        self.model       = model
+        self.concurrency = concurrency
+        self.order       = order
+        self.progress_every = progress_every
+        self.stats = {"prompts": 0, "errors": 0, "skipped": 0}
+
+    def _run_one(self, index: int, line: str) -> dict:
+        record = {"index": index}
+        try:
+            item = json.loads(line)
+            record["id"] = item.get("id")
+            reasoning, answer = self.client.complete(to_messages(item), item.get("model") or self.model)
+            record.update(answer=answer, reasoning=reasoning)
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        return record
+
+    def run(self, lines, out, done: set = frozenset()) -> dict:
+        """Reads `lines` lazily, writes one JSON line per prompt to `out`; returns stats."""
+        t0 = time.perf_counter()
+        last_report = t0
+        inflight = {}                   # future -> index
+        ready, queue = {}, deque()      # order="input": finished results / indices awaiting output
+
+        def emit(record: dict):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            self.stats["prompts"] += 1
+            if "error" in record:
+                self.stats["errors"] += 1
+
+        def collect():
+            nonlocal last_report
+            finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                index = inflight.pop(fut)
+                if self.order == "input":
+                    ready[index] = fut.result()
+                else:
+                    emit(fut.result())
+            while queue and queue[0] in ready:
+                emit(ready.pop(queue.popleft()))
+            now = time.perf_counter()
+            if self.progress_every and now - last_report >= self.progress_every:
+                last_report = now
+                print(json.dumps(self._summary(now - t0)), file=sys.stderr)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+            for index, line in enumerate(lines):
+                if not line.strip():
+                    continue
+                if index in done:
+                    self.stats["skipped"] += 1
+                    continue
+                while len(inflight) >= self.concurrency:
+                    collect()
+                inflight[pool.submit(self._run_one, index, line)] = index
+                queue.append(index)
+            while inflight:
+                collect()
+        return self._summary(time.perf_counter() - t0)
+
+    def _summary(self, elapsed: float) -> dict:
+        return {**self.stats, "elapsed_secs": round(elapsed, 3),
+                "prompts_per_min": round(self.stats["prompts"] * 60 / elapsed, 2) if elapsed else None}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("input", nargs="?", help="JSONL prompts; default stdin")
+    ap.add_argument("--out", help="JSONL results; default stdout")
+    ap.add_argument("--url", default=os.getenv("OLLAMA_URL", "http://127.0.0.1:11434"))
+    ap.add_argument("--model", default=DEFAULT_MODEL, help="for lines without a \"model\"")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--order", choices=("input", "completion"), default="input")
+    ap.add_argument("--temperature", type=float, default=0.7)
+    ap.add_argument("--max-tokens", type=int, default=4096)
+    ap.add_argument("--resume", action="store_true", help="skip prompts already answered in --out")
+    ap.add_argument("--progress", type=float, default=30, help="seconds between progress lines; 0 = off")
+    args = ap.parse_args()
+    if args.resume and not args.out:
+        ap.error("--resume needs --out")
+
+    from client import ChatClient
+    from transport import POOL_MAXSIZE
+    if args.concurrency > POOL_MAXSIZE:
+        logger.warning(f"--concurrency {args.concurrency} exceeds OLLAMA_POOL_MAXSIZE={POOL_MAXSIZE}; "
+                       "requests will wait for a connection")
+    client = ChatClient(args.url)
+    client.params = {"temperature": args.temperature, "max_new_tokens": args.max_tokens}
+
+    done = load_checkpoint(args.out) if args.resume else set()
+    src = open(args.input) if args.input else sys.stdin
+    out = open(args.out, "a" if args.resume else "w") if args.out else sys.stdout
+    try:
+        summary = BatchRunner(client, args.model, args.concurrency, args.order, args.progress).run(src, out, done)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if out is not sys.stdout:
+            out.close()
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark for ThinkParser.
+
+Feeds synthetic 100k-token streams (reasoning + answer, tags split across
+deltas) through the incremental parser and through the old grow-and-split
+loop, and reports deltas/s for each.
+
+    python bench/bench_think_parser.py [--tokens 100000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from think_parser import ThinkParser  # noqa: E402
+
+WORDS = ["the", " model", " reasons", " about", " grid", " load", ",", " then", " answers", ".", "\n"]
+
+
+def synthetic_stream(tokens: int, seed: int = 0) -> list:
+    """~tokens deltas: <think> + reasoning (90%) + </think> + answer, with tags split mid-way."""
+    rng = random.Random(seed)
+    think_tokens = int(tokens * 0.9)
+    deltas = ["<thi", "nk>"]
+    deltas += [rng.choice(WORDS) for _ in range(think_tokens)]
+    deltas += ["</", "think", ">"]
+    deltas += [rng.choice(WORDS) for _ in range(tokens - think_tokens)]
+    return deltas
+
+
+def run_parser(deltas: list) -> int:
+    parser = ThinkParser()
+    n = 0
+    for d in deltas:
+        n += len(parser.feed(d))
+    n += len(parser.flush())
+    return n
+
+
+def run_naive(deltas: list) -> int:
+    """The pre-ThinkParser loop from ChatClient.stream_message."""
+    collected, reasoning_buf, answer_buf, in_think = "", "", "", False
+    n = 0
+    for delta in deltas:
+        collected += delta
+        if not in_think and "<think>" in collected:
+            in_think, collected = True, collected.split("<think>", 1)[1]
+        if in_think and "</think>" not in collected:
+            reasoning_buf += delta
+            n += 1
+            continue
+        if in_think and "</think>" in collected:
+            before, after = collected.split("</think>", 1)
+            reasoning_buf += before
+            in_think, collected = False, ""
+            answer_buf += after
+            n += 1
+            continue
+        answer_buf += delta
+        n += 1
+    return n
+
+
+def bench(fn, deltas: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(deltas)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--tokens", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--skip-naive", action="store_true", help="skip the quadratic baseline")
+    args = ap.parse_args()
+
+    deltas = synthetic_stream(args.tokens)
+    parser = ThinkParser()
+    for d in deltas:
+        parser.feed(d)
+    parser.flush()
+    assert "<" not in parser.reasoning and "<" not in parser.answer, "tag leaked into output"
+
+    t = bench(run_parser, deltas, args.repeat)
+    print(f"ThinkParser: {len(deltas)} deltas in {t * 1000:.1f} ms ({len(deltas) / t:,.0f} deltas/s)")
+    if not args.skip_naive:
+        t = bench(run_naive, deltas, args.repeat)
+        print(f"naive loop:  {len(deltas)} deltas in {t * 1000:.1f} ms ({len(deltas) / t:,.0f} deltas/s)")
+
+
+if __name__ == "__main__":
+    main()
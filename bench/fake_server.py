@@ -0,0 +1,132 @@
+"""
+Local stand-in for an Ollama server's OpenAI-compatible API, for benchmarks.
+
+Serves /v1/chat/completions (streamed SSE or plain JSON) at a configurable
+token rate with optional <think> blocks and jitter, plus /api/ps and
+/api/generate so routing and residency see a healthy, loaded backend.
+
+    python bench/fake_server.py --port 11555 --tokens-per-sec 50 --think-tokens 200
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = [" grid", " load", " power", " the", " model", " answer", " is", " balanced", ",", "."]
+
+
+class FakeConfig:
+    def __init__(self, tokens_per_sec: float = 50.0, think_tokens: int = 0, answer_tokens: int = 200,
+                 jitter: float = 0.2, prefill_secs: float = 0.05, seed: int = 0):
+        self.tokens_per_sec = tokens_per_sec
+        self.think_tokens   = think_tokens
+        self.answer_tokens  = answer_tokens
+        self.jitter         = jitter
+        self.prefill_secs   = prefill_secs
+        self.seed           = seed
+
+
+def make_handler(cfg: FakeConfig):
+    loaded = set()  # models requested so far, reported as resident by /api/ps
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, body: dict, status: int = 200):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/ps":
+                return self._json({"models": [{"name": m, "size": 0} for m in sorted(loaded)]})
+            self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            length  = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            loaded.add(payload.get("model"))
+            if self.path == "/api/generate":
+                return self._json({"model": payload.get("model"), "done": True})
+            if self.path != "/v1/chat/completions":
+                return self._json({"error": "not found"}, 404)
+
+            rng    = random.Random(cfg.seed + zlib.crc32(json.dumps(payload.get("messages"), sort_keys=True).encode()))
+            max_t  = payload.get("max_tokens") or cfg.answer_tokens
+            tokens = []
+            if cfg.think_tokens:
+                tokens += ["<think>"] + [rng.choice(WORDS) for _ in range(cfg.think_tokens)] + ["</think>"]
+            tokens += [rng.choice(WORDS) for _ in range(min(cfg.answer_tokens, max_t))]
+            usage = {"prompt_tokens": sum(len(m.get("content", "")) // 4 for m in payload.get("messages", [])),
+                     "completion_tokens": len(tokens)}
+
+            time.sleep(cfg.prefill_secs)
+            if not payload.get("stream"):
+                time.sleep(len(tokens) / cfg.tokens_per_sec)
+                return self._json({
+                    "choices": [{"message": {"role": "assistant", "content": "".join(tokens)}}],
+                    "usage": {**usage, "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"]},
+                })
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            interval = 1 / cfg.tokens_per_sec
+            try:
+                for tok in tokens:
+                    event = {"choices": [{"delta": {"content": tok}}]}
+                    self._chunk(f"data: {json.dumps(event)}\n\n")
+                    time.sleep(max(interval * (1 + rng.uniform(-cfg.jitter, cfg.jitter)), 0))
+                final = {"choices": [{"delta": {}, "finish_reason": "stop"}],
+                         "usage": {**usage, "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"]}}
+                self._chunk(f"data: {json.dumps(final)}\n\n")
+                self._chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # Client went away (cancelled generation): stop decoding, like the real server
+                self.close_connection = True
+
+        def _chunk(self, text: str):
+            data = text.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_server(cfg: FakeConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Starts the fake server on a daemon thread; port 0 picks a free port (see server.server_port)."""
+    server = ThreadingHTTPServer((host, port), make_handler(cfg))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11555)
+    ap.add_argument("--tokens-per-sec", type=float, default=50.0)
+    ap.add_argument("--think-tokens", type=int, default=0)
+    ap.add_argument("--answer-tokens", type=int, default=200)
+    ap.add_argument("--jitter", type=float, default=0.2)
+    ap.add_argument("--prefill-secs", type=float, default=0.05)
+    args = ap.parse_args()
+    cfg = FakeConfig(args.tokens_per_sec, args.think_tokens, args.answer_tokens, args.jitter, args.prefill_secs)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(cfg))
+    print(f"fake Ollama listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Load generator for ChatClient against a real or fake Ollama backend.
+
+Runs N concurrent sessions, each sending `--turns` messages through
+stream_message (or send_message with --mode send), and reports
+time-to-first-token, inter-token latency, tokens/s, SQLite write latency
+and memory per session as JSON, so runs can be diffed.
+
+    python bench/loadgen.py --sessions 16 --turns 4 --out run.json
+    python bench/loadgen.py --url http://gpu1:11434 --model qwen3:14b
+
+Without --url a local fake server (bench/fake_server.py) is started, so the
+suite needs no GPU.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"n": 0}
+    v = sorted(values)
+    pick = lambda q: v[min(int(q * len(v)), len(v) - 1)]
+    return {"n": len(v), "mean": sum(v) / len(v), "p50": pick(0.50), "p90": pick(0.90),
+            "p99": pick(0.99), "max": v[-1]}
+
+
+def timed(fn, sink: list):
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            sink.append(time.perf_counter() - t0)
+    return wrapper
+
+
+class Session:
+    def __init__(self, client, model: str, mode: str):
+        self.client = client
+        self.model  = model
+        self.mode   = mode
+        self.chat_id = f"bench-{id(self)}"
+        self.ttft, self.itl, self.rates = [], [], []
+        self.errors = 0
+
+    def turn(self, prompt: str) -> None:
+        t0 = time.perf_counter()
+        if self.mode == "send":
+            reply, *_ = self.client.send_message(self.chat_id, prompt, self.model)
+            elapsed = time.perf_counter() - t0
+            self.ttft.append(elapsed)
+            self.rates.append(len(reply.split()) / elapsed if elapsed else 0)
+            return
+        first = last = None
+        chunks = 0
+        for chunk in self.client.stream_message(self.chat_id, prompt, self.model):
+            if chunk.get("type") not in ("think", "answer"):
+                continue
+            now = time.perf_counter()
+            if first is None:
+                first = now
+                self.ttft.append(now - t0)
+            else:
+                self.itl.append(now - last)
+            last = now
+            chunks += 1
+        if first is not None and last > first:
+            self.rates.append((chunks - 1) / (last - first))
+
+
+def run(args) -> dict:
+    server = None
+    url = args.url
+    if url is None:
+        from fake_server import FakeConfig, start_server
+        server = start_server(FakeConfig(tokens_per_sec=args.tokens_per_sec, think_tokens=args.think_tokens,
+                                         answer_tokens=args.answer_tokens, jitter=args.jitter))
+        url = f"http://127.0.0.1:{server.server_port}"
+
+    tmp = tempfile.mkdtemp(prefix="gridbench-")
+    os.environ["CHAT_DB_PATH"] = os.path.join(tmp, "bench.db")
+    from client import ChatClient
+
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    mem_before = tracemalloc.get_traced_memory()[0] if args.trace_memory else 0
+
+    # Storage is shared by every client in the process, so it is instrumented once
+    from storage import get_storage
+    storage, db_writes = get_storage(), []
+    storage.append_message = timed(storage.append_message, db_writes)
+    storage.create_chat    = timed(storage.create_chat, db_writes)
+
+    sessions = []
+    for _ in range(args.sessions):
+        client = ChatClient(url)
+        client.params = {"temperature": args.temperature, "max_new_tokens": args.answer_tokens}
+        sessions.append(Session(client, args.model, args.mode))
+
+    def worker(s: Session):
+        for i in range(args.turns):
+            try:
+                s.turn(f"benchmark question {i} from {s.chat_id}")
+            except Exception:
+                s.errors += 1
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(s,)) for s in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    mem_after = tracemalloc.get_traced_memory()[0] if args.trace_memory else 0
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_scale = 1 if platform.system() == "Darwin" else 1024  # ru_maxrss is KiB on Linux
+    collect = lambda attr: [x for s in sessions for x in getattr(s, attr)]
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "backend": "fake" if server else url,
+        "wall_secs": wall,
+        "turns": args.sessions * args.turns,
+        "errors": sum(s.errors for s in sessions),
+        "ttft_secs": percentiles(collect("ttft")),
+        "itl_secs": percentiles(collect("itl")),
+        "tokens_per_sec_per_stream": percentiles(collect("rates")),
+        "db_write_secs": percentiles(db_writes),
+        "memory_per_session_bytes": {
+            "max_rss_delta": (rss_after - rss_before) * rss_scale / args.sessions,
+            "traced": (mem_after - mem_before) / args.sessions if args.trace_memory else None,
+        },
+    }
+    for s in sessions:
+        s.client.close()
+    if server:
+        server.shutdown()
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="backend to load; default starts a local fake server")
+    ap.add_argument("--model", default="llama3.2:3b")
+    ap.add_argument("--mode", choices=("stream", "send"), default="stream")
+    ap.add_argument("--sessions", type=int, default=8)
+    ap.add_argument("--turns", type=int, default=3)
+    ap.add_argument("--temperature", type=float, default=0.7)
+    ap.add_argument("--tokens-per-sec", type=float, default=100.0, help="fake server decode rate")
+    ap.add_argument("--think-tokens", type=int, default=50, help="fake server <think> length")
+    ap.add_argument("--answer-tokens", type=int, default=100, help="fake server answer length")
+    ap.add_argument("--jitter", type=float, default=0.2, help="fake server inter-token jitter")
+    ap.add_argument("--trace-memory", action="store_true", help="use tracemalloc (slower, more precise)")
+    ap.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = ap.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_ENTRIES     = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES       = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_SECS        = float(os.getenv("CACHE_TTL_SECS", "86400"))
+CACHE_MAX_TEMPERATURE = float(os.getenv("CACHE_MAX_TEMPERATURE", "0"))
+CACHE_DB_PATH         = os.getenv("CACHE_DB_PATH")  # unset = memory tier only
+CACHE_DB_MAX_ROWS     = int(os.getenv("CACHE_DB_MAX_ROWS", "100000"))
+
+# Payload fields that change the completion; everything else (stream, n) does not.
+_KEY_FIELDS = ("model", "messages", "temperature", "top_p", "max_tokens", "seed")
+
+
+class CompletionCache:
+    """
+    Exact-match cache of completion text, keyed on a canonical hash of the
+    model, messages and sampling parameters.
+
+    Tier 1 is an in-process LRU bounded by entry count and bytes; tier 2 is an
+    optional SQLite table shared between processes. Both expire entries after
+    `ttl` seconds. Only deterministic requests are cacheable (see cacheable()).
+    """
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 ttl: float = CACHE_TTL_SECS, max_temperature: float = CACHE_MAX_TEMPERATURE,
+                 db_path: str = CACHE_DB_PATH, db_max_rows: int = CACHE_DB_MAX_ROWS):
+        self.max_entries     = max_entries
+        self.max_bytes       = max_bytes
+        self.ttl             = ttl
+        self.max_temperature = max_temperature
+        self.db_max_rows     = db_max_rows
+        self.stats           = {"hits": 0, "misses": 0, "db_hits": 0, "evictions": 0, "puts": 0}
+        self._lru   = OrderedDict()  # key -> (stored_at, text)
+        self._bytes = 0
+        self._lock  = threading.Lock()
+        self._db    = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL;")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completion_cache "
+                "(key TEXT PRIMARY KEY, stored_at REAL, value TEXT);"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(payload: dict) -> str:
+        canonical = {k: payload.get(k) for k in _KEY_FIELDS}
+        blob = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def cacheable(self, payload: dict) -> bool:
+        """Deterministic settings only: temperature at or below max_temperature, or a fixed seed."""
+        if payload.get("n", 1) != 1:
+            return False
+        return payload.get("seed") is not None or payload.get("temperature", 1.0) <= self.max_temperature
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._lru.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[1]
+                self._evict(key)
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT stored_at, value FROM completion_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[0] <= self.ttl:
+                    self.stats["hits"] += 1
+                    self.stats["db_hits"] += 1
+                    self._remember(key, row[0], row[1])
+                    return row[1]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, text: str) -> None:
+        now = time.time()
+        with self._lock:
+            self.stats["puts"] += 1
+            self._remember(key, now, text)
+            if self._db is not None:
+                try:
+                    with self._db:
+                        self._db.execute(
+                            "INSERT OR REPLACE INTO completion_cache(key, stored_at, value) VALUES(?, ?, ?)",
+                            (key, now, text)
+                        )
+                        # Occasional prune keeps the table bounded without a per-put COUNT(*)
+                        if self.stats["puts"] % 256 == 0:
+                            self._db.execute("DELETE FROM completion_cache WHERE stored_at < ?", (now - self.ttl,))
+                            self._db.execute(
+                                "DELETE FROM completion_cache WHERE key IN (SELECT key FROM completion_cache "
+                                "ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                                (self.db_max_rows,)
+                            )
+                except sqlite3.Error as e:
+                    logger.warning(f"Completion cache write failed: {e}")
+
+    def _remember(self, key: str, stored_at: float, text: str) -> None:
+        size = len(text.encode())
+        if size > self.max_bytes:
+            return
+        if key in self._lru:
+            self._evict(key)
+        self._lru[key] = (stored_at, text)
+        self._bytes += size
+        while len(self._lru) > self.max_entries or self._bytes > self.max_bytes:
+            self._evict(next(iter(self._lru)))
+            self.stats["evictions"] += 1
+
+    def _evict(self, key: str) -> None:
+        _, text = self._lru.pop(key)
+        self._bytes -= len(text.encode())
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._lru), "bytes": self._bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CompletionCache:
+    """Process-wide cache shared by every ChatClient."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CompletionCache()
+        return _cache
+
+
+def replay(text: str, chunk_size: int = 16):
+    """Yields a cached completion back as stream-sized deltas."""
+    for i in range(0, len(text), chunk_size):
+        yield text[i:i + chunk_size]
@@ -1,13 +1,92 @@
 import json
 import logging
-import requests
-from storage import StorageManager
-import re
+import threading
+import time
+from storage import get_storage
+from context import ContextBuilder
+from think_parser import ThinkParser, split_think
+from router import get_pool
+from residency import get_residency
+from titles import TitleGenerator
+from cache import get_cache, replay
+from singleflight import get_singleflight, SINGLEFLIGHT
+from scheduler import get_scheduler, PRIORITY_TITLE
+from metrics import Trace, timed
+from usage import check_quota
 from typing import Generator, Dict, Any
 import subprocess
 
 logger = logging.getLogger(__name__)
 
+COMPLETIONS_PATH = "/v1/chat/completions"
+# Appended to an answer whose generation was stopped before it finished
+TRUNCATED_MARKER = "[generation stopped]"
+
+
+class CancelToken:
+    """
+    Stops one generation from any thread. cancel() runs the registered
+    callbacks (the router's registers closing the upstream response, so
+    the backend stops decoding); callbacks registered later run at once.
+    """
+    def __init__(self):
+        self.reason     = None
+        self._event     = threading.Event()
+        self._callbacks = []
+        self._lock      = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception as e:
+                logger.debug(f"Cancel callback failed: {e}")
+
+    def on_cancel(self, cb) -> None:
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(cb)
+                return
+        cb()
+
+
+def parse_sse_delta(line: bytes) -> str | None:
+    """Content delta from one SSE line of a streamed completion, or None for keep-alives/[DONE]/junk."""
+    if not line or line.startswith(b"data: [DONE]"):
+        return None
+    piece = line.decode("utf-8").removeprefix("data: ")
+    try:
+        token_data = json.loads(piece)
+        return token_data["choices"][0]["delta"].get("content", "")
+    except Exception:
+        return None
+
+def parse_sse_usage(line: bytes) -> dict | None:
+    """Token counts from the final chunk of a stream sent with stream_options.include_usage, else None."""
+    if b'"usage"' not in line:
+        return None
+    try:
+        return json.loads(line.decode("utf-8").removeprefix("data: "))["usage"] or None
+    except Exception:
+        return None
+
+
+def token_counts(reported: dict | None) -> dict:
+    """prompt_tokens / completion_tokens out of a response's usage block (whichever it has)."""
+    if not reported:
+        return {}
+    return {k: reported[k] for k in ("prompt_tokens", "completion_tokens") if reported.get(k) is not None}
+
 class ChatClient:
     """
     HTTP-based chat client for GridAI.
@@ -15,11 +94,50 @@ class ChatClient:
     """
     def __init__(self, url: str = "http://127.0.0.1:11434"):
         self.url     = url.rstrip("/")
-        self.storage = StorageManager()
+        # Picks a backend per request; a single-node pool of `url` unless OLLAMA_BACKENDS is set
+        self.pool    = get_pool(self.url)
+        self.residency = get_residency(self.pool)
+        self.storage = get_storage()
         self.params  = {}
+        self.context = ContextBuilder()
+        self.last_context_stats = None
+        self.titles  = TitleGenerator(self._generate_title, self.storage)
+        self.cache   = get_cache()
+        # Identical requests in flight at the same time share one generation
+        self.flights = get_singleflight() if SINGLEFLIGHT else None
+        self.scheduler = get_scheduler()
 
-    def _generate_title(self, prompt: str, model: str) -> str:
-        title_payload = {
+    def _build_messages(self, history: list, model: str) -> tuple:
+        """
+        Trims `history` to the model's prompt budget. Returns (messages, stats);
+        the stats are also kept in self.last_context_stats for display.
+        """
+        max_tokens = self.params.get("max_new_tokens", 4096)
+        messages, stats = self.context.build(history, model, max_tokens)
+        self.last_context_stats = stats
+        logger.debug(
+            f"Context for {model}: sent {stats['sent_tokens']} tokens, "
+            f"dropped {stats['dropped_tokens']} ({stats['dropped_messages']} messages)"
+        )
+        return messages, stats
+
+    def _payload(self, model: str, messages: list, stream: bool) -> dict:
+        payload = {
+            "model":       model,
+            "messages":    messages,
+            "temperature": self.params.get("temperature", 0.7),
+            "top_p":       self.params.get("top_p", 0.9),
+            "max_tokens":  self.params.get("max_new_tokens", 4096),
+            "n":           1,
+            "stream":      stream
+        }
+        if stream:
+            # Token counts in the last chunk; non-streamed responses always carry them
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def _title_payload(self, prompt: str, model: str) -> dict:
+        return {
             "model": model,
             "messages": [
                 {"role": "system", "content": "You are a helpful assistant that suggests chat titles."},
@@ -31,144 +149,298 @@ class ChatClient:
             "n": 1,
             "stream": False
         }
-        r = requests.post(f"{self.url}/v1/chat/completions", json=title_payload, timeout=30)
-        r.raise_for_status()
-        title = r.json()["choices"][0]["message"]["content"].strip().strip('"')
-        return title
 
-    def send_message(self, chat_id: str, prompt: str, model: str) -> (str, list, str | None, dict | None):
+    def _cache_key(self, payload: dict, cacheable: bool = None) -> str | None:
+        if self.cache is None:
+            return None
+        if cacheable is None:
+            cacheable = self.cache.cacheable(payload)
+        return self.cache.key(payload) if cacheable else None
+
+    def _complete(self, payload: dict, timeout: float = 300, cacheable: bool = None, usage: dict = None) -> str:
+        """
+        Non-streaming completion text, served from the response cache when allowed,
+        or shared with an identical request already in flight.
+        A live request fills `usage` with the model and the token counts the backend
+        reported; of requests sharing one, only the one charged for it does (see
+        SingleFlight.follow), the others are left out like a cache hit.
+        """
+        key = self._cache_key(payload, cacheable)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if self.flights is None:
+            return self._post_completion(payload, timeout, key, usage)
+
+        def start(flight):
+            def fetch():
+                yield self._post_completion(payload, timeout, key, flight.usage)
+            return fetch(), None
+
+        flight, _ = self.flights.join(self.flights.key(payload), start)
+        return "".join(self.flights.follow(flight, usage=usage))
+
+    def _post_completion(self, payload: dict, timeout: float, key: str | None, usage: dict | None) -> str:
+        with self.residency.slot(payload["model"]):
+            r = self.pool.post(payload["model"], COMPLETIONS_PATH, payload, timeout=timeout)
+        data = r.json()
+        text = data["choices"][0]["message"]["content"]
+        if usage is not None:
+            usage.update(model=payload["model"], **token_counts(data.get("usage")))
+        if key:
+            self.cache.put(key, text)
+        return text
+
+    def _stream_deltas(self, payload: dict, trace: Trace = None,
+                       cancel: CancelToken = None, usage: dict = None) -> Generator[str, None, None]:
+        """
+        Content deltas of a streamed completion. A cache hit is replayed as a
+        stream; a completed live stream is stored for next time. Stream phases
+        (first byte / first token / last token) are marked on `trace`.
+        Ends early, closing the upstream connection, once `cancel` fires.
+        A live stream fills `usage` like _complete (counts arrive in the last chunk).
+
+        An identical stream already in flight is joined instead: its deltas so
+        far are replayed, then followed live. The stream is read on a
+        background thread, so cancelling detaches this caller and the backend
+        only stops once every caller sharing it has gone. `trace` then gets the
+        first/last token as this caller saw them; the upstream's own phases go
+        to a separate "completion_stream" trace, and `usage` is filled only for
+        the caller charged for the generation.
+        """
+        key = self._cache_key(payload)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                if trace:
+                    trace.attrs["cache"] = "hit"
+                for delta in replay(cached):
+                    if cancel is not None and cancel.cancelled:
+                        return
+                    yield delta
+                return
+        if self.flights is None:
+            yield from self._live_deltas(payload, key, trace, cancel, usage)
+            return
+
+        def start(flight):
+            # Runs on the flight's thread, which can outlive any one caller's trace
+            upstream = CancelToken()
+            upstream_trace = Trace("completion_stream", model=payload["model"])
+
+            def source():
+                try:
+                    yield from self._live_deltas(payload, key, upstream_trace, upstream, flight.usage)
+                finally:
+                    upstream_trace.finish(cancelled=upstream.reason)
+            return source(), upstream.cancel
+
+        flight, leader = self.flights.join(self.flights.key(payload), start)
+        if trace and not leader:
+            trace.attrs["singleflight"] = "joined"
+        last_token = None
+        for delta in self.flights.follow(flight, cancel, usage):
+            last_token = time.perf_counter()
+            if trace:
+                trace.mark("first_token")
+            yield delta
+        if trace and last_token is not None:
+            trace.marks["last_token"] = last_token - trace.start
+
+    def _live_deltas(self, payload: dict, key: str | None, trace: Trace = None,
+                     cancel: CancelToken = None, usage: dict = None) -> Generator[str, None, None]:
+        """One streamed request to a backend; cached under `key` once it completes."""
+        parts = []
+        first_byte = first_token = last_token = None
+        with self.residency.slot(payload["model"]):
+            if trace:
+                trace.mark("request_sent")
+            for line in self.pool.stream_lines(payload["model"], COMPLETIONS_PATH, payload, timeout=300,
+                                               cancel=cancel):
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                    if trace:
+                        trace.mark("first_byte")
+                    # Only now is it a request to charge for, not one cancelled while waiting
+                    if usage is not None:
+                        usage["model"] = payload["model"]
+                delta = parse_sse_delta(line)
+                if not delta:
+                    if usage is not None:
+                        usage.update(token_counts(parse_sse_usage(line)))
+                    continue
+                # Timestamps only; the trace itself is touched once per phase
+                last_token = time.perf_counter()
+                if first_token is None:
+                    first_token = last_token
+                    if trace:
+                        trace.mark("first_token")
+                if key:
+                    parts.append(delta)
+                yield delta
+        if trace and last_token is not None:
+            trace.marks["last_token"] = last_token - trace.start
+        if key and not (cancel is not None and cancel.cancelled):
+            self.cache.put(key, "".join(parts))
+
+    def complete(self, messages: list, model: str) -> tuple:
+        """
+        One completion outside any chat (nothing is stored), for batch jobs.
+        Returns (reasoning or None, answer), split on <think> like chat replies.
+        """
+        raw = self._complete(self._payload(model, messages, stream=False)).strip()
+        return split_think(raw)
+
+    def check_quota(self, chat_id: str, user: str = None) -> None:
+        """Raises usage.QuotaExceeded if `user` (default: the chat's owner) is over today's token quota."""
+        check_quota(self.storage, user or self.storage.get_chat_owner(chat_id))
+
+    @staticmethod
+    def _reply_usage(usage: dict, started: float, prompt_tokens: int, completion_chars: int,
+                     user: str = None) -> dict | None:
+        """
+        Completes what _complete/_stream_deltas recorded for the stored reply:
+        duration, who to bill, and estimates (`prompt_tokens` from the context
+        stats, ~4 chars/token) for counts the backend did not send, e.g. on a
+        cancelled stream. None for a cache hit, which cost no GPU time.
+        """
+        if not usage:
+            return None
+        usage.setdefault("prompt_tokens", prompt_tokens)
+        usage.setdefault("completion_tokens", completion_chars // 4)
+        usage["duration_ms"] = int((time.perf_counter() - started) * 1000)
+        if user:
+            usage["owner"] = user
+        return usage
+
+    @timed("generate_title")
+    def _generate_title(self, prompt: str, model: str) -> str:
+        # Lowest priority: titles never hold a slot an interactive request is waiting for.
+        # A cached title is as good as a fresh one, whatever the temperature.
+        with self.scheduler.slot(model, priority=PRIORITY_TITLE, timeout=30):
+            title = self._complete(self._title_payload(prompt, model), timeout=30, cacheable=True)
+        return title.strip().strip('"')
+
+    def send_message(self, chat_id: str, prompt: str, model: str,
+                     user: str = None) -> (str, list, str | None, dict | None):
         self.storage.create_chat(chat_id)
+        self.check_quota(chat_id, user)
         self.storage.append_message(chat_id, "user", prompt)
-        history = self.storage.fetch_history(chat_id)
+        history = self.storage.fetch_history(chat_id, include_reasoning=self.context.include_reasoning)
 
-        title = None
-        if len(history) == 1:
-            try:
-                title = self._generate_title(prompt, 'llama3.2:3b')
-                self.storage.set_chat_title(chat_id, title)
-            except Exception as e:
-                logger.warning(f"Failed to generate title: {e}")
+        # Title is generated in the background; only reported if it is already done
+        title_future = self.titles.submit(chat_id, prompt) if len(history) == 1 else None
 
-        messages = [{"role": m["role"], "content": m["content"]} for m in history]
-        payload = {
-            "model":       model,
-            "messages":    messages,
-            "temperature": self.params.get("temperature", 0.7),
-            "top_p":       self.params.get("top_p", 0.9),
-            "max_tokens":  self.params.get("max_new_tokens", 4096),
-            "n":           1,
-            "stream":      False
-        }
+        messages, stats = self._build_messages(history, model)
+        payload  = self._payload(model, messages, stream=False)
 
-        resp = requests.post(f"{self.url}/v1/chat/completions", json=payload, timeout=300)
-        resp.raise_for_status()
-        raw_response = resp.json()["choices"][0]["message"]["content"].strip()
+        usage, started = {}, time.perf_counter()
+        raw_response = self._complete(payload, usage=usage).strip()
 
         # --- Extract <think> reasoning and final answer ---
-        think_match = re.search(r"<think>\s*(.*?)\s*</think>\s*(.*)", raw_response, re.DOTALL)
-        if think_match:
-            reasoning    = think_match.group(1).strip()
-            final_answer = think_match.group(2).strip()
+        reasoning, reply = split_think(raw_response)
+        if reasoning is not None:
             # Persist the reasoning as its own message
             self.storage.append_message(chat_id, "assistant_think", reasoning)
-            reply = final_answer
-        else:
-            reasoning = None
-            reply     = raw_response
 
-        # Persist the final answer
-        self.storage.append_message(chat_id, "assistant", reply)
-        return reply, self.storage.fetch_history(chat_id), title, {"reasoning": reasoning, "raw": raw_response}
+        # Persist the final answer, with what it cost
+        self.storage.append_message(chat_id, "assistant", reply,
+                                    usage=self._reply_usage(usage, started, stats["sent_tokens"], len(raw_response), user))
+        title = title_future.result() if title_future and title_future.done() else None
+        return reply, self.storage.fetch_history(chat_id), title, {"reasoning": reasoning, "raw": raw_response, "context": stats}
 
-    def stream_message(self, chat_id: str, prompt: str, model: str) -> Generator[Dict[str, str], None, None]:
+    def _persist_reply(self, chat_id: str, parser: ThinkParser, truncated: bool = False,
+                       usage: dict = None) -> None:
+        """
+        Stores what the parser has collected: any unsaved reasoning, then the
+        answer (marked if truncated) with the generation's `usage`.
+        """
+        if parser.in_think and parser.reasoning:
+            # Stream ended inside an unclosed <think> block
+            self.storage.append_message(chat_id, "assistant_think", parser.reasoning.strip())
+        answer = parser.answer.strip()
+        if truncated:
+            answer = f"{answer} {TRUNCATED_MARKER}".strip()
+        self.storage.append_message(chat_id, "assistant", answer, usage=usage)
+
+    def stream_message(self, chat_id: str, prompt: str, model: str,
+                       cancel: CancelToken = None, user: str = None) -> Generator[Dict[str, str], None, None]:
         """
         Streams a chat completion, splitting out <think>...</think> reasoning and the final answer.
         Yields dicts of the form {'type': 'think' or 'answer', 'text': delta_chunk}.
-        Also generates a title on the first user message.
+        On the first user message a title is generated in the background and
+        yielded as {'type': 'title', 'text': title} as soon as it is ready.
+
+        cancel.cancel() (from any thread), or closing this generator early,
+        stops the generation upstream; the partial answer is stored with
+        TRUNCATED_MARKER.
+
+        Token usage is billed to `user` (default: the chat's owner). Raises
+        usage.QuotaExceeded, before anything is stored or sent, if they have
+        used up today's token quota.
         """
+        self.check_quota(chat_id, user)
+        trace = Trace("stream_message", model=model)
         # Persist user prompt
         self.storage.append_message(chat_id, "user", prompt)
-        history = self.storage.fetch_history(chat_id)
-
-        # Generate chat title on first prompt
-        if len(history) == 1:
-            try:
-                title = self._generate_title(prompt, "llama3.2:3b")
-                self.storage.set_chat_title(chat_id, title)
-            except Exception as e:
-                logger.warning(f"Failed to generate title: {e}")
-
-        messages = [{"role": m["role"], "content": m["content"]} for m in history]
-        payload = {
-            "model":       model,
-            "messages":    messages,
-            "temperature": self.params.get("temperature", 0.7),
-            "top_p":       self.params.get("top_p", 0.9),
-            "max_tokens":  self.params.get("max_new_tokens", 4096),
-            "n":           1,
-            "stream":      True
-        }
-
-        collected     = ""
-        reasoning_buf = ""
-        answer_buf    = ""
-        in_think      = False
-        think_open    = "<think>"
-        think_close   = "</think>"
-
-        with requests.post(f"{self.url}/v1/chat/completions", json=payload, stream=True, timeout=300) as r:
-            r.raise_for_status()
-            for line in r.iter_lines():
-                if not line or line.startswith(b"data: [DONE]"):
-                    continue
+        # Reasoning is only fetched (and decompressed) if it goes into the prompt
+        history = self.storage.fetch_history(chat_id, include_reasoning=self.context.include_reasoning)
+        trace.mark("history_fetched")
 
-                piece = line.decode("utf-8").removeprefix("data: ")
-                try:
-                    token_data = json.loads(piece)
-                    delta = token_data["choices"][0]["delta"].get("content", "")
-                except Exception:
-                    continue
+        # Generate chat title on first prompt, off the critical path
+        title_future = self.titles.submit(chat_id, prompt) if len(history) == 1 else None
 
-                collected += delta
+        messages, stats = self._build_messages(history, model)
+        payload  = self._payload(model, messages, stream=True)
 
-                # Enter reasoning phase
-                if not in_think and think_open in collected:
-                    in_think, collected = True, collected.split(think_open, 1)[1]
+        parser = ThinkParser()
 
-                # Still reasoning
-                if in_think and think_close not in collected:
-                    reasoning_buf += delta
-                    yield {"type": "think", "text": delta}
-                    continue
-
-                # Close reasoning phase
-                if in_think and think_close in collected:
-                    before_close, after_close = collected.split(think_close, 1)
-                    reasoning_buf += before_close
-                    yield {"type": "think", "text": before_close}
-                    
+        def handle(events):
+            nonlocal title_future
+            if title_future is not None and title_future.done():
+                title, title_future = title_future.result(), None
+                yield {"type": "title", "text": title}
+            for kind, text in events:
+                if kind == "think_end":
                     # Persist the full reasoning
-                    self.storage.append_message(chat_id, "assistant_think", reasoning_buf.strip())
-                    in_think, collected = False, ""
-                    # leftover becomes answer
-                    if after_close:
-                        answer_buf += after_close
-                        yield {"type": "answer", "text": after_close}
-                    continue
+                    self.storage.append_message(chat_id, "assistant_think", parser.reasoning.strip())
+                    parser.reset_reasoning()
+                else:
+                    yield {"type": kind, "text": text}
 
-                # Normal answer streaming
-                answer_buf += delta
-                yield {"type": "answer", "text": delta}
-
-        # Persist only the final answer
-        final_answer = answer_buf.strip()
-        self.storage.append_message(chat_id, "assistant", final_answer)
+        cancel   = cancel or CancelToken()
+        finished = False
+        usage, received, started = {}, 0, time.perf_counter()
+        # Database maintenance holds off while tokens are being persisted
+        with self.storage.maintenance.streaming():
+            try:
+                for delta in self._stream_deltas(payload, trace, cancel, usage):
+                    received += len(delta)
+                    yield from handle(parser.feed(delta))
+                if cancel.cancelled:
+                    parser.flush()
+                else:
+                    yield from handle(parser.flush())
+                    finished = True
+            except GeneratorExit:
+                # Consumer went away mid-stream (e.g. a Streamlit rerun)
+                cancel.cancel("abandoned")
+                raise
+            finally:
+                # Persist only the final answer, or whatever arrived before a cancel
+                if finished or cancel.cancelled or parser.answer or parser.reasoning:
+                    self._persist_reply(chat_id, parser, truncated=not finished,
+                                        usage=self._reply_usage(usage, started, stats["sent_tokens"], received, user))
+        trace.finish(sent_tokens=stats["sent_tokens"],
+                     cancelled=cancel.reason if cancel.cancelled else None)
 
-    def list_chats(self) -> list:
-        return self.storage.list_chats()
+    def list_chats(self, owner: str = None) -> list:
+        return self.storage.list_chats(owner)
 
     def get_history(self, chat_id: str) -> list:
         return self.storage.fetch_history(chat_id)
 
     def close(self):
-        self.storage.close()
+        # Storage is shared process-wide; just make sure this client's writes are committed
+        self.storage.flush()
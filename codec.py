@@ -0,0 +1,75 @@
+"""
+Compression for large message bodies.
+
+Rows above COMPRESS_MIN_BYTES are stored in messages.body as a compressed
+BLOB with messages.codec naming the codec; small rows stay plain TEXT in
+messages.content. zstd is used when the `zstandard` package is installed,
+zlib otherwise. zlib rows can always be read back; zstd rows need `zstandard`
+installed wherever the database is read.
+"""
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION        = os.getenv("CHAT_DB_COMPRESSION", "auto")  # auto | zstd | zlib | off
+COMPRESS_MIN_BYTES = int(os.getenv("CHAT_DB_COMPRESS_MIN_BYTES", "2048"))
+ZLIB_LEVEL         = 6
+ZSTD_LEVEL         = 3
+
+# Only rows the full-text index never reads: messages_fts is an external-content
+# table over messages.content, so searchable rows must keep their text there.
+COMPRESSIBLE_ROLES = ("assistant_think",)
+
+
+def _default_codec() -> str | None:
+    if COMPRESSION == "off":
+        return None
+    if COMPRESSION in ("auto", "zstd") and zstandard is not None:
+        return "zstd"
+    return "zlib"
+
+
+CODEC = _default_codec()
+
+
+def compress(text: str, codec: str = CODEC) -> bytes:
+    data = text.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(body: bytes, codec: str) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("message stored with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(body).decode("utf-8")
+    if codec == "zlib":
+        return zlib.decompress(body).decode("utf-8")
+    raise ValueError(f"unknown codec {codec!r}")
+
+
+def encode(role: str, text: str) -> tuple:
+    """
+    (content, body, codec, raw_size) to store for one message. Returns the
+    text as-is when the role is searchable, the text is small, or
+    compression would not save space.
+    """
+    raw_size = len(text.encode("utf-8"))
+    if CODEC is None or role not in COMPRESSIBLE_ROLES or raw_size < COMPRESS_MIN_BYTES:
+        return text, None, None, None
+    body = compress(text)
+    if len(body) >= raw_size:
+        return text, None, None, None
+    return None, body, CODEC, raw_size
+
+
+def decode(content: str | None, body: bytes | None, codec: str | None) -> str | None:
+    """Inverse of encode(); plain rows pass straight through."""
+    if codec is None:
+        return content
+    return decompress(body, codec)
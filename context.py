@@ -0,0 +1,103 @@
+from typing import Callable, List, Dict, Tuple
+from models import context_window
+
+THINK_ROLE = "assistant_think"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token plus per-message overhead).
+    Good enough for budgeting; swap in a real tokenizer via ContextBuilder(count_tokens=...).
+    """
+    return len(text) // 4 + 4
+
+
+class ContextBuilder:
+    """
+    Assembles the `messages` payload for a completion request under a token budget.
+
+    - system messages are always kept
+    - assistant_think rows are left out unless include_reasoning=True
+    - the newest turns are kept verbatim; the first turn that does not fit is
+      collapsed to its head, everything older is dropped
+    """
+    def __init__(self,
+                 budget: int | None = None,
+                 include_reasoning: bool = False,
+                 min_collapse_tokens: int = 64,
+                 count_tokens: Callable[[str], int] = estimate_tokens):
+        self.budget              = budget
+        self.include_reasoning   = include_reasoning
+        self.min_collapse_tokens = min_collapse_tokens
+        self.count_tokens        = count_tokens
+
+    def budget_for(self, model: str, max_new_tokens: int = 0) -> int:
+        """Prompt budget for `model`: the fixed budget if set, else context window minus the generation reserve."""
+        if self.budget is not None:
+            return self.budget
+        return max(context_window(model) - max_new_tokens, 0)
+
+    def _to_payload(self, m: Dict[str, str]) -> Dict[str, str] | None:
+        if m["role"] == THINK_ROLE:
+            if not self.include_reasoning:
+                return None
+            return {"role": "assistant", "content": f"<think>{m['content']}</think>"}
+        return {"role": m["role"], "content": m["content"]}
+
+    def _collapse(self, content: str, tokens: int) -> str:
+        # Keep the head of the message; chars-per-token ratio taken from the message itself.
+        ratio = len(content) / max(self.count_tokens(content), 1)
+        keep  = max(int((tokens - 8) * ratio), 0)
+        return content[:keep].rstrip() + " …[truncated]"
+
+    def build(self, history: List[Dict[str, str]], model: str,
+              max_new_tokens: int = 0) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """
+        Returns (messages, stats) where stats reports the budget and how many
+        tokens/messages were sent, dropped and collapsed.
+        """
+        budget = self.budget_for(model, max_new_tokens)
+        stats  = {"budget": budget, "sent_tokens": 0, "dropped_tokens": 0,
+                  "sent_messages": 0, "dropped_messages": 0, "collapsed_messages": 0}
+
+        system, turns = [], []
+        for m in history:
+            payload = self._to_payload(m)
+            if payload is None:
+                stats["dropped_tokens"]   += self.count_tokens(m["content"])
+                stats["dropped_messages"] += 1
+            elif payload["role"] == "system":
+                system.append(payload)
+            else:
+                turns.append(payload)
+
+        remaining = budget
+        for m in system:
+            remaining -= self.count_tokens(m["content"])
+
+        kept = []
+        # Walk newest-first; the latest message is always sent even if it alone exceeds the budget.
+        for i in range(len(turns) - 1, -1, -1):
+            m    = turns[i]
+            cost = self.count_tokens(m["content"])
+            if cost <= remaining or not kept:
+                kept.append(m)
+                remaining -= cost
+                continue
+            drop_upto = i + 1
+            if remaining >= self.min_collapse_tokens:
+                collapsed = {"role": m["role"], "content": self._collapse(m["content"], remaining)}
+                kept.append(collapsed)
+                stats["collapsed_messages"] += 1
+                stats["dropped_tokens"]     += cost - self.count_tokens(collapsed["content"])
+                remaining = 0
+                drop_upto = i
+            for older in turns[:drop_upto]:
+                stats["dropped_tokens"]   += self.count_tokens(older["content"])
+                stats["dropped_messages"] += 1
+            break
+
+        messages = system + kept[::-1]
+        stats["sent_tokens"]   = sum(self.count_tokens(m["content"]) for m in messages)
+        stats["sent_messages"] = len(messages)
+        return messages, stats
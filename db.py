@@ -0,0 +1,199 @@
+import sqlite3
+import os
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DB_FILE          = os.getenv("CHAT_DB_PATH", "chat_history.db")
+BUSY_TIMEOUT_MS  = int(os.getenv("CHAT_DB_BUSY_TIMEOUT_MS", "5000"))
+MMAP_SIZE        = int(os.getenv("CHAT_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHE_SIZE_KB    = int(os.getenv("CHAT_DB_CACHE_KB", str(64 * 1024)))
+DURABILITY       = os.getenv("CHAT_DB_DURABILITY", "normal")
+# 'quick' (PRAGMA quick_check) | 'full' (integrity_check) | 'off'; runs in the background
+INTEGRITY_CHECK  = os.getenv("CHAT_DB_INTEGRITY_CHECK", "quick")
+INTEGRITY_INTERVAL_SECS = float(os.getenv("CHAT_DB_INTEGRITY_INTERVAL_SECS", str(24 * 3600)))
+
+# PRAGMA synchronous level per durability setting
+SYNC_LEVELS = {"off": "OFF", "normal": "NORMAL", "full": "FULL"}
+
+
+class Database:
+    """
+    Connection management for one SQLite file, shared by every manager in the process.
+
+    - one writer connection, serialised by a lock: use `with db.write() as conn:`
+    - one read-only connection per thread: db.reader(); connections of
+      threads that have exited are closed as new ones open, since Streamlit
+      runs each script rerun on a fresh thread
+    - the same pragmas everywhere (WAL, busy_timeout, mmap_size, cache_size)
+
+    In WAL mode readers work from a snapshot, so they never wait on the writer.
+    Opening only does a cheap sanity read of the schema. The O(size)
+    integrity check runs on a background thread (start_integrity_checker);
+    if it finds corruption it leaves a <path>.needs-recovery marker, and the
+    next process to open the file confirms with a full integrity_check and
+    moves the corrupt file aside to <path>.corrupt. A file that cannot even
+    be read is moved aside straight away.
+    """
+    def __init__(self, path: str, durability: str = DURABILITY):
+        self.path        = path
+        self.synchronous = SYNC_LEVELS[durability.lower()]
+        self._write_lock = threading.RLock()
+        self._readers    = {}  # thread -> its read-only connection
+        self._readers_lock = threading.Lock()
+        self._checker    = None
+        self.integrity   = None  # result of the last background check, e.g. "ok"
+        self.writer      = self._open_writer()
+
+    def _configure(self, conn: sqlite3.Connection) -> None:
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE};")
+        # Negative cache_size is in KiB
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB};")
+
+    def _connect_writer(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute(f"PRAGMA synchronous={self.synchronous};")
+        self._configure(conn)
+        return conn
+
+    @property
+    def _marker(self) -> str:
+        return self.path + ".needs-recovery"
+
+    def _open_writer(self) -> sqlite3.Connection:
+        conn = None
+        try:
+            conn = self._connect_writer()
+            # Cheap: fails fast on a file that is not a database or has a broken header
+            conn.execute("SELECT count(*) FROM sqlite_master;").fetchone()
+            if os.path.exists(self._marker):
+                # A background check flagged this file; confirm before discarding it
+                if conn.execute("PRAGMA integrity_check;").fetchone()[0] != 'ok':
+                    raise sqlite3.DatabaseError("Integrity check failed")
+                os.remove(self._marker)
+            return conn
+        except (sqlite3.DatabaseError, sqlite3.OperationalError) as e:
+            logger.error(f"{self.path} failed to open cleanly ({e}); moving it aside")
+            try: conn.close()
+            except: pass
+            # The WAL goes with the file it belongs to; it must not be replayed into the new one
+            for suffix in ("", "-wal"):
+                if os.path.exists(self.path + suffix):
+                    os.replace(self.path + suffix, self.path + ".corrupt" + suffix)
+            for suffix in ("-shm", ".needs-recovery"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+            return self._connect_writer()
+
+    def check_integrity(self, mode: str = INTEGRITY_CHECK) -> str:
+        """
+        Runs quick_check or integrity_check on a separate read-only connection,
+        so writers and readers carry on meanwhile. Returns "ok" or the first
+        problem found; on failure, flags the file for recovery at next start.
+        """
+        pragma = "integrity_check" if mode == "full" else "quick_check"
+        t0 = time.monotonic()
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            result = conn.execute(f"PRAGMA {pragma};").fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            result = str(e)
+        finally:
+            conn.close()
+        self.integrity = result
+        if result == "ok":
+            logger.info(f"{pragma} of {self.path} passed in {time.monotonic() - t0:.1f}s")
+        else:
+            logger.error(f"{pragma} of {self.path} failed: {result}; will recover at next start")
+            with open(self._marker, "w") as f:
+                f.write(result + "\n")
+        return result
+
+    def start_integrity_checker(self, mode: str = INTEGRITY_CHECK,
+                                interval: float = INTEGRITY_INTERVAL_SECS) -> threading.Thread | None:
+        """
+        Checks integrity now and then every `interval` seconds (0 = once) on a
+        daemon thread. Idempotent; does nothing when mode is 'off'.
+        """
+        if mode == "off":
+            return None
+        with self._readers_lock:
+            if self._checker is None:
+                self._checker = threading.Thread(target=self._integrity_loop, args=(mode, interval),
+                                                 name="sqlite-integrity", daemon=True)
+                self._checker.start()
+        return self._checker
+
+    def _integrity_loop(self, mode: str, interval: float):
+        while True:
+            try:
+                if self.check_integrity(mode) != "ok":
+                    return
+            except Exception as e:
+                logger.warning(f"Integrity check of {self.path} could not run: {e}")
+            if interval <= 0:
+                return
+            time.sleep(interval)
+
+    @contextmanager
+    def write(self):
+        """
+        Exclusive use of the writer connection for one transaction: commits on
+        success, rolls back on error.
+        """
+        with self._write_lock:
+            try:
+                yield self.writer
+                self.writer.commit()
+            except BaseException:
+                self.writer.rollback()
+                raise
+
+    def reader(self) -> sqlite3.Connection:
+        """This thread's read-only connection, opened on first use."""
+        me = threading.current_thread()
+        conn = self._readers.get(me)
+        if conn is not None:
+            return conn
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        self._configure(conn)
+        with self._readers_lock:
+            for t in [t for t in self._readers if not t.is_alive()]:
+                self._readers.pop(t).close()
+            self._readers[me] = conn
+        return conn
+
+    def set_durability(self, durability: str) -> None:
+        self.synchronous = SYNC_LEVELS[durability.lower()]
+        with self._write_lock:
+            self.writer.execute(f"PRAGMA synchronous={self.synchronous};")
+
+    def close(self) -> None:
+        with self._readers_lock:
+            readers, self._readers = self._readers, {}
+        for conn in readers.values():
+            try: conn.close()
+            except: pass
+        with self._write_lock:
+            try: self.writer.close()
+            except: pass
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path: str = None) -> Database:
+    """Process-wide Database for `path` (default CHAT_DB_PATH); starts its background integrity check."""
+    path = os.path.abspath(path or DB_FILE)
+    with _databases_lock:
+        db = _databases.get(path)
+        if db is None:
+            db = _databases[path] = Database(path)
+            db.start_integrity_checker()
+        return db
@@ -0,0 +1,123 @@
+"""
+Export and import of chat history, streamed in constant memory.
+
+    python history_io.py export history.jsonl --user alice@example.com --since 2025-01-01
+    python history_io.py export history.parquet --exclude-role assistant_think
+    python history_io.py import history.jsonl --db other.db
+
+The format follows the file extension (.jsonl or .parquet); "-" is
+stdin/stdout as JSONL. Parquet needs pyarrow. Each record is one message:
+msg_id, chat_id, owner, title, chat_created_at, role, content, timestamp.
+"""
+import argparse
+import json
+import logging
+import sys
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("msg_id", "chat_id", "owner", "title", "chat_created_at", "role", "content", "timestamp")
+PARQUET_ROW_GROUP = 50_000
+
+
+def _format(path: str, fmt: str = None) -> str:
+    fmt = fmt or ("parquet" if path.endswith(".parquet") else "jsonl")
+    if fmt == "parquet" and pa is None:
+        raise RuntimeError("Parquet needs pyarrow: pip install pyarrow")
+    return fmt
+
+
+def _parquet_schema():
+    return pa.schema([(f, pa.int64() if f == "msg_id" else pa.string()) for f in FIELDS])
+
+
+def write_records(records, path: str, fmt: str = None) -> int:
+    """Writes an iterable of message dicts to `path`; returns how many were written."""
+    n = 0
+    if _format(path, fmt) == "parquet":
+        schema = _parquet_schema()
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            batch = []
+            for r in records:
+                batch.append(r)
+                if len(batch) >= PARQUET_ROW_GROUP:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                    n, batch = n + len(batch), []
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                n += len(batch)
+        return n
+    out = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+    try:
+        for r in records:
+            out.write(json.dumps(r, ensure_ascii=False) + "\n")
+            n += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return n
+
+
+def read_records(path: str, fmt: str = None):
+    """Yields message dicts from `path`, one row group / line at a time."""
+    if _format(path, fmt) == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=PARQUET_ROW_GROUP):
+            yield from batch.to_pylist()
+        return
+    src = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in src:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="database -> file")
+    exp.add_argument("path")
+    exp.add_argument("--user", help="only this owner's chats (\"anonymous\" for logged-out chats)")
+    exp.add_argument("--since", help="messages at or after this ISO date/time")
+    exp.add_argument("--until", help="messages before this ISO date/time")
+    exp.add_argument("--role", action="append", help="only these roles (repeatable)")
+    exp.add_argument("--exclude-role", action="append", help="skip these roles, e.g. assistant_think")
+    exp.add_argument("--no-archived", action="store_true", help="skip chats moved to archive files")
+    imp = sub.add_parser("import", help="file -> database")
+    imp.add_argument("path")
+    imp.add_argument("--keep-ids", action="store_true", help="keep msg_ids (replaces rows with the same id)")
+    imp.add_argument("--batch-size", type=int, default=20000, help="messages per transaction")
+    for p in (exp, imp):
+        p.add_argument("--db", help="database file; default CHAT_DB_PATH")
+        p.add_argument("--format", choices=("jsonl", "parquet"), help="default: from the file extension")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        _format(args.path, args.format)
+    except RuntimeError as e:
+        ap.error(str(e))
+
+    from storage import StorageManager
+    storage = StorageManager(args.db)
+    try:
+        if args.command == "export":
+            records = storage.iter_messages(args.user, args.since, args.until, args.role, args.exclude_role,
+                                            include_archived=not args.no_archived)
+            n = write_records(records, args.path, args.format)
+            logger.info(f"Exported {n} messages")
+        else:
+            storage.import_messages(read_records(args.path, args.format), args.batch_size, args.keep_ids)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+MAINTENANCE_INTERVAL_SECS = float(os.getenv("CHAT_DB_MAINTENANCE_INTERVAL_SECS", "30"))
+IDLE_SECS                 = float(os.getenv("CHAT_DB_IDLE_SECS", "5"))
+WAL_CHECKPOINT_BYTES      = int(float(os.getenv("CHAT_DB_WAL_CHECKPOINT_MB", "8")) * 1024 ** 2)
+WAL_MAX_BYTES             = int(float(os.getenv("CHAT_DB_WAL_MAX_MB", "64")) * 1024 ** 2)
+OPTIMIZE_INTERVAL_SECS    = float(os.getenv("CHAT_DB_OPTIMIZE_INTERVAL_SECS", "3600"))
+VACUUM_PAGES              = int(os.getenv("CHAT_DB_VACUUM_PAGES", "1000"))
+# A one-off VACUUM to switch an existing file to auto_vacuum=INCREMENTAL rewrites
+# the whole file, so it only runs by itself below this size
+FULL_VACUUM_MAX_BYTES     = int(float(os.getenv("CHAT_DB_FULL_VACUUM_MAX_MB", "256")) * 1024 ** 2)
+
+_AUTO_VACUUM_INCREMENTAL = 2
+
+
+class Maintenance:
+    """
+    Background upkeep for a StorageManager's database.
+
+    Each tick:
+      - checkpoints the WAL: TRUNCATE once it passes WAL_CHECKPOINT_BYTES and
+        the database is idle, PASSIVE while streaming only if it passes WAL_MAX_BYTES
+      - when idle: incremental_vacuum of free pages, PRAGMA optimize on a
+        schedule, one batch of compressing older large messages and one
+        batch of archiving idle chats
+
+    "Idle" means no stream in progress (see streaming()) and no write for
+    IDLE_SECS, so maintenance never competes with token persistence.
+    """
+    def __init__(self, storage, interval: float = MAINTENANCE_INTERVAL_SECS, idle_secs: float = IDLE_SECS):
+        self.storage   = storage
+        self.db        = storage.db
+        self.interval  = interval
+        self.idle_secs = idle_secs
+        self.last_write = 0.0
+        self.last_run  = {}  # task -> wall time it last ran
+        self.counts    = {}  # task -> times run
+        self._streams  = 0
+        self._lock     = threading.Lock()
+        self._thread   = None
+
+    # --- activity ---
+
+    def touch(self) -> None:
+        """Called on every write."""
+        self.last_write = time.monotonic()
+
+    @contextmanager
+    def streaming(self):
+        """Marks a generation in progress; maintenance backs off until it ends."""
+        with self._lock:
+            self._streams += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._streams -= 1
+            self.touch()
+
+    def idle(self) -> bool:
+        return not self._streams and time.monotonic() - self.last_write >= self.idle_secs
+
+    # --- tasks ---
+
+    def _ran(self, task: str) -> None:
+        self.last_run[task] = time.time()
+        self.counts[task] = self.counts.get(task, 0) + 1
+
+    def wal_bytes(self) -> int:
+        try:
+            return os.path.getsize(self.db.path + "-wal")
+        except OSError:
+            return 0
+
+    def checkpoint(self, mode: str = "PASSIVE") -> tuple:
+        """PRAGMA wal_checkpoint(mode); returns (busy, wal_frames, checkpointed_frames)."""
+        with span("wal_checkpoint", mode=mode.lower()), self.db.write() as conn:
+            result = conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
+        self._ran(f"checkpoint_{mode.lower()}")
+        return tuple(result)
+
+    def incremental_vacuum(self, pages: int = VACUUM_PAGES) -> int:
+        """Returns up to `pages` free pages to the filesystem; returns how many were free before."""
+        reader = self.db.reader()
+        free = reader.execute("PRAGMA freelist_count;").fetchone()[0]
+        if not free:
+            return 0
+        with span("incremental_vacuum"), self.db.write() as conn:
+            # Each step of the pragma frees one page; it has to be stepped to completion
+            conn.execute(f"PRAGMA incremental_vacuum({pages});").fetchall()
+        self._ran("incremental_vacuum")
+        return free
+
+    def optimize(self) -> None:
+        with span("optimize"), self.db.write() as conn:
+            conn.execute("PRAGMA optimize;").fetchall()
+        self._ran("optimize")
+
+    def enable_incremental_vacuum(self) -> bool:
+        """
+        Switches an existing file to auto_vacuum=INCREMENTAL, which needs a full
+        VACUUM. Returns False if the mode was already set.
+        """
+        with self.db.write() as conn:
+            if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] == _AUTO_VACUUM_INCREMENTAL:
+                return False
+            with span("vacuum"):
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+                conn.execute("VACUUM;")
+        self._ran("vacuum")
+        logger.info(f"{self.db.path} switched to auto_vacuum=INCREMENTAL")
+        return True
+
+    def run_once(self) -> None:
+        wal = self.wal_bytes()
+        idle = self.idle()
+        if idle and wal >= WAL_CHECKPOINT_BYTES:
+            self.checkpoint("TRUNCATE")
+        elif wal >= WAL_MAX_BYTES:
+            # Non-blocking; keeps the WAL bounded during long busy periods
+            self.checkpoint("PASSIVE")
+        if not idle:
+            return
+        reader = self.db.reader()
+        if reader.execute("PRAGMA auto_vacuum;").fetchone()[0] != _AUTO_VACUUM_INCREMENTAL:
+            size = os.path.getsize(self.db.path) if os.path.exists(self.db.path) else 0
+            if size <= FULL_VACUUM_MAX_BYTES:
+                self.enable_incremental_vacuum()
+        else:
+            self.incremental_vacuum()
+        if time.time() - self.last_run.get("optimize", 0) >= OPTIMIZE_INTERVAL_SECS:
+            self.optimize()
+        # Rewrite a batch of pre-compression rows; stops mattering once they are done
+        if self.storage.compress_existing(max_batches=1):
+            self._ran("compress")
+        if self.storage.archive_idle_chats(max_batches=1):
+            self._ran("archive")
+
+    # --- loop ---
+
+    def start(self) -> threading.Thread | None:
+        """Runs run_once() every `interval` seconds on a daemon thread. Idempotent."""
+        if self.interval <= 0:
+            return None
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="sqlite-maintenance", daemon=True)
+                self._thread.start()
+        return self._thread
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning(f"Database maintenance failed: {e}")
+
+    def stats(self) -> dict:
+        reader = self.db.reader()
+        pragma = lambda name: reader.execute(f"PRAGMA {name};").fetchone()[0]
+        return {
+            "wal_bytes":      self.wal_bytes(),
+            "page_size":      pragma("page_size"),
+            "page_count":     pragma("page_count"),
+            "freelist_pages": pragma("freelist_count"),
+            "auto_vacuum":    {0: "none", 1: "full", 2: "incremental"}[pragma("auto_vacuum")],
+            "idle":           self.idle(),
+            "active_streams": self._streams,
+            "last_run":       dict(self.last_run),
+            "runs":           dict(self.counts),
+        }
@@ -0,0 +1,236 @@
+"""
+Process-wide metrics and request tracing for the chat hot path.
+
+Counters and histograms are exported in the Prometheus text format, either
+over HTTP (METRICS_PORT) or by periodically rewriting a file (METRICS_FILE).
+Per-request traces are appended as JSON lines to TRACE_LOG when it is set.
+Nothing here runs per token: callers record timestamps in locals and report
+once per phase.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_PORT    = int(os.getenv("METRICS_PORT", "0"))  # 0 = no HTTP endpoint
+METRICS_FILE    = os.getenv("METRICS_FILE")
+TRACE_LOG       = os.getenv("TRACE_LOG")
+
+# Seconds; spans from sub-millisecond SQLite writes up to 5-minute generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _fmt_labels(key: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self._values = {}
+        self._lock   = threading.Lock()
+
+    def inc(self, n: float = 1, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in self._values.items():
+                lines.append(f"{self.name}{_fmt_labels(key)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = buckets
+        self._values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock   = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, row in self._values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, row):
+                    cumulative += n
+                    le = _fmt_labels(key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                cumulative += row[len(self.buckets)]
+                le = _fmt_labels(key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {row[-1]}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock    = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str = "", buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+SPAN_SECONDS = REGISTRY.histogram("gridai_span_seconds", "Duration of instrumented operations")
+SPAN_ERRORS  = REGISTRY.counter("gridai_span_errors_total", "Instrumented operations that raised")
+RENDER_FRAMES = REGISTRY.counter("gridai_render_frames_total", "Streamlit frames drawn while streaming")
+
+
+@contextmanager
+def span(name: str, **labels):
+    """Times the block into gridai_span_seconds{span=name}."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        SPAN_ERRORS.inc(span=name, **labels)
+        raise
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - t0, span=name, **labels)
+
+
+def timed(name: str):
+    """Decorator form of span()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class Trace:
+    """
+    Timeline of one request: mark() records named points relative to the
+    start; finish() feeds them to the stream-phase histogram and, if
+    TRACE_LOG is set, appends the whole trace as one JSON line.
+    """
+    _log_lock = threading.Lock()
+
+    def __init__(self, name: str, **attrs):
+        self.name  = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.wall  = time.time()
+        self.marks = {}
+
+    def mark(self, point: str) -> None:
+        if point not in self.marks:
+            self.marks[point] = time.perf_counter() - self.start
+
+    def finish(self, **attrs) -> None:
+        self.mark("end")
+        if not METRICS_ENABLED:
+            return
+        for point, offset in self.marks.items():
+            SPAN_SECONDS.observe(offset, span=f"{self.name}.{point}")
+        if TRACE_LOG:
+            record = {"trace": self.name, "ts": self.wall, **self.attrs, **attrs,
+                      "marks": {k: round(v, 6) for k, v in self.marks.items()}}
+            try:
+                with self._log_lock, open(TRACE_LOG, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not write trace log: {e}")
+
+
+# --- exporters ---
+
+_exporter_started = False
+_exporter_lock    = threading.Lock()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _write_file_loop(path: str, interval: float):
+    while True:
+        time.sleep(interval)
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(REGISTRY.render())
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics file: {e}")
+
+
+def start_exporter(port: int = METRICS_PORT, path: str = METRICS_FILE, interval: float = 15) -> None:
+    """Starts the HTTP endpoint and/or file writer once per process, as configured."""
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+    if port:
+        server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    if path:
+        threading.Thread(target=_write_file_loop, args=(path, interval), name="metrics-file", daemon=True).start()
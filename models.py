@@ -0,0 +1,39 @@
+"""
+Model catalogue shared by the UI and the chat client.
+
+`ram` is the resident footprint reported by the backend, `ctx` the context
+window (in tokens) the model is served with.
+"""
+
+ALL_MODELS = {
+    "LLaMA 3.2 3B":    {"name": "llama3.2:3b",    "ram": "2.0 GB", "ctx": 8192,  "supports_think": False},
+    "LLaMA 3.1 8B":    {"name": "llama3.1:8b",    "ram": "4.9 GB", "ctx": 8192,  "supports_think": False},
+    "Qwen 3 14B":      {"name": "qwen3:14b",      "ram": "9.3 GB", "ctx": 16384, "supports_think": True},
+    "DeepSeek R1 70B": {"name": "deepseek-r1:70b", "ram": "42 GB", "ctx": 16384, "supports_think": True},
+    "LLaMA 3.1 70B":   {"name": "llama3.1:70b",   "ram": "39 GB",  "ctx": 16384, "supports_think": False},
+}
+
+# Lookup by backend model name ("qwen3:14b") rather than display label.
+MODELS_BY_NAME = {cfg["name"]: cfg for cfg in ALL_MODELS.values()}
+
+DEFAULT_CTX = 4096
+
+
+def model_config(model: str) -> dict:
+    """Returns the catalogue entry for a backend model name, or an empty dict."""
+    return MODELS_BY_NAME.get(model, {})
+
+
+def context_window(model: str) -> int:
+    """Context window in tokens for `model`, falling back to DEFAULT_CTX."""
+    return model_config(model).get("ctx", DEFAULT_CTX)
+
+
+def ram_bytes(model: str) -> int:
+    """Resident footprint of `model` in bytes, parsed from the catalogue's "42 GB" strings (0 if unknown)."""
+    ram = model_config(model).get("ram")
+    if not ram:
+        return 0
+    value, _, unit = ram.partition(" ")
+    scale = {"GB": 1024 ** 3, "MB": 1024 ** 2}.get(unit.strip().upper(), 1024 ** 3)
+    return int(float(value) * scale)
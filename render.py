@@ -0,0 +1,51 @@
+import os
+import time
+
+RENDER_FPS       = float(os.getenv("RENDER_FPS", "8"))
+RENDER_MAX_BYTES = int(os.getenv("RENDER_MAX_BYTES", "4096"))
+
+
+class ThrottledRenderer:
+    """
+    Coalesces streamed deltas into a Streamlit placeholder.
+
+    add() only buffers; the placeholder is re-rendered at most `fps` times a
+    second, or sooner once `max_bytes` of new text is pending. Call flush()
+    when the stream ends so the final text is always drawn.
+    """
+    def __init__(self, placeholder, template: str = "{}", fps: float = RENDER_FPS,
+                 max_bytes: int = RENDER_MAX_BYTES):
+        self.placeholder = placeholder
+        self.template    = template
+        self.interval    = 1 / fps if fps > 0 else 0
+        self.max_bytes   = max_bytes
+        self.frames      = 0
+        self._text       = ""
+        self._pending    = []
+        self._pending_n  = 0
+        self._last       = 0.0
+
+    @property
+    def text(self) -> str:
+        if self._pending:
+            self._text += "".join(self._pending)
+            self._pending, self._pending_n = [], 0
+        return self._text
+
+    def add(self, delta: str) -> None:
+        if not delta:
+            return
+        self._pending.append(delta)
+        self._pending_n += len(delta)
+        now = time.monotonic()
+        if self._pending_n >= self.max_bytes or now - self._last >= self.interval:
+            self._draw(now)
+
+    def flush(self) -> None:
+        if self._pending or not self.frames:
+            self._draw(time.monotonic())
+
+    def _draw(self, now: float) -> None:
+        self.placeholder.markdown(self.template.format(self.text), unsafe_allow_html=True)
+        self.frames += 1
+        self._last = now
@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from models import ram_bytes
+from router import BackendPool
+
+logger = logging.getLogger(__name__)
+
+BACKEND_MEMORY_GB   = float(os.getenv("BACKEND_MEMORY_GB", "48"))
+MODEL_KEEP_ALIVE    = os.getenv("MODEL_KEEP_ALIVE", "30m")
+WARM_INTERVAL_SECS  = float(os.getenv("WARM_INTERVAL_SECS", "60"))
+MAX_DEFER_SECS      = float(os.getenv("MAX_DEFER_SECS", "20"))
+LOAD_BYTES_PER_SEC  = float(os.getenv("LOAD_BYTES_PER_SEC", str(2 * 1024 ** 3)))
+
+
+class ResidencyManager:
+    """
+    Memory-aware model residency on top of a BackendPool.
+
+    Knows each backend's memory budget and (via the pool's /api/ps probes)
+    which models are loaded. slot(model) lets a request through at once if
+    the model is resident or fits, or if loading it only evicts idle models.
+    Otherwise the request is deferred, up to `max_defer` seconds, until the
+    models it would evict go idle, so requests for a cold model queue up
+    and load it once instead of thrashing. A background loop preloads the
+    most requested models that fit, with a long keep_alive.
+    """
+    def __init__(self, pool: BackendPool, memory_gb: float = BACKEND_MEMORY_GB,
+                 keep_alive: str = MODEL_KEEP_ALIVE, warm_interval: float = WARM_INTERVAL_SECS,
+                 max_defer: float = MAX_DEFER_SECS):
+        self.pool          = pool
+        self.budget        = int(memory_gb * 1024 ** 3)
+        self.keep_alive    = keep_alive
+        self.warm_interval = warm_interval
+        self.max_defer     = max_defer
+        self.popularity    = {}  # model -> decayed request count
+        self._active  = {}       # model -> requests in flight through this manager
+        self._cond    = threading.Condition()
+        self._warmer  = None
+
+    # --- state ---
+
+    def _size(self, backend, model: str) -> int:
+        return backend.resident.get(model) or ram_bytes(model)
+
+    def _can_run(self, model: str) -> bool:
+        """True if some backend has `model` loaded, has room for it, or would only evict idle models."""
+        if self._active.get(model):
+            # Already admitted (loaded or loading): batch behind it
+            return True
+        need = ram_bytes(model)
+        for b in self.pool.backends:
+            if not b.serves(model) or not b.healthy:
+                continue
+            if model in b.resident:
+                return True
+            used = sum(self._size(b, m) for m in b.resident)
+            if used + need <= self.budget:
+                return True
+            if not any(self._active.get(m) for m in b.resident):
+                return True
+        return False
+
+    def loaded_now(self) -> dict:
+        """model -> backend URLs it is currently resident on, as of the last probe."""
+        loaded = {}
+        for b in self.pool.backends:
+            for m in b.resident:
+                loaded.setdefault(m, []).append(b.url)
+        return loaded
+
+    def expected_load_secs(self, model: str) -> float:
+        """Extra latency to expect before the first token: 0 when resident, else an estimated cold load."""
+        if model in self.loaded_now():
+            return 0.0
+        return ram_bytes(model) / LOAD_BYTES_PER_SEC
+
+    # --- admission ---
+
+    @contextmanager
+    def slot(self, model: str):
+        """Counts a request against `model`, deferring it while loading would evict busy models."""
+        self._ensure_warmer()
+        deadline = time.monotonic() + self.max_defer
+        with self._cond:
+            self.popularity[model] = self.popularity.get(model, 0) + 1
+            while not self._can_run(model):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.info(f"Deferred {model} for {self.max_defer}s; loading anyway")
+                    break
+                self._cond.wait(min(remaining, 1.0))
+            self._active[model] = self._active.get(model, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[model] -= 1
+                self._cond.notify_all()
+
+    # --- warming ---
+
+    def preload(self, model: str) -> None:
+        """Loads `model` on every backend that serves it and pins it with keep_alive."""
+        for b in self.pool.backends:
+            if not b.serves(model) or not b.healthy:
+                continue
+            try:
+                # An empty generate request just loads the model
+                b.transport.post("/api/generate", {"model": model, "keep_alive": self.keep_alive}, timeout=300)
+            except Exception as e:
+                logger.warning(f"Preloading {model} on {b.url} failed: {e}")
+
+    def warm(self) -> list:
+        """Preloads the most popular models that fit the budget together; returns the ones it loaded."""
+        with self._cond:
+            ranked = sorted(self.popularity, key=self.popularity.get, reverse=True)
+            # Halve counts each round so popularity tracks recent demand
+            self.popularity = {m: n / 2 for m, n in self.popularity.items() if n >= 0.5}
+        chosen, used = [], 0
+        for model in ranked:
+            size = ram_bytes(model)
+            if used + size <= self.budget:
+                chosen.append(model)
+                used += size
+        loaded = self.loaded_now()
+        with self._cond:
+            # Never warm a model at the cost of evicting one that is serving requests
+            warmed = [m for m in chosen if m not in loaded and self._can_run(m)]
+        for model in warmed:
+            self.preload(model)
+        return warmed
+
+    def _ensure_warmer(self) -> None:
+        if self._warmer is None and self.warm_interval > 0:
+            with self._cond:
+                if self._warmer is None:
+                    self._warmer = threading.Thread(target=self._warm_loop, name="model-warmer", daemon=True)
+                    self._warmer.start()
+
+    def _warm_loop(self):
+        while True:
+            time.sleep(self.warm_interval)
+            try:
+                self.warm()
+            except Exception as e:
+                logger.warning(f"Model warm-up failed: {e}")
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_residency(pool: BackendPool) -> ResidencyManager:
+    """One manager per pool, shared process-wide."""
+    with _managers_lock:
+        manager = _managers.get(id(pool))
+        if manager is None:
+            manager = _managers[id(pool)] = ResidencyManager(pool)
+        return manager
@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Generator, Iterable
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+from transport import get_transport
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# "http://gpu1:11434=llama3.1:70b,deepseek-r1:70b;http://gpu2:11434=*"
+OLLAMA_BACKENDS     = os.getenv("OLLAMA_BACKENDS", "")
+PROBE_INTERVAL_SECS = float(os.getenv("OLLAMA_PROBE_INTERVAL", "10"))
+
+# Failures where the request never reached a model: safe to send elsewhere.
+_RETRYABLE_STATUS = {502, 503}
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+class _Retryable(Exception):
+    pass
+
+
+def _never_sent(e: Exception) -> bool:
+    """True if `e` means the request provably never reached the backend."""
+    if isinstance(e, _Retryable):
+        return True
+    # requests wraps a failed connect (refused, DNS, connect timeout) as
+    # ConnectionError(MaxRetryError(reason=...)); a connection aborted after the
+    # body was sent wraps a ProtocolError instead, and may have reached a model
+    cause = e.args[0] if isinstance(e, requests.ConnectionError) and e.args else None
+    return isinstance(getattr(cause, "reason", None), ConnectTimeoutError)
+
+
+class Backend:
+    """One Ollama server: which models it serves, whether it is up, what it has loaded."""
+    def __init__(self, url: str, models: Iterable[str] | None = None):
+        self.url       = url.rstrip("/")
+        self.models    = set(models) if models else None  # None = serves everything
+        self.transport = get_transport(self.url)
+        self.inflight  = 0
+        self.healthy   = True
+        self.resident  = {}  # model -> bytes in (V)RAM, from /api/ps
+        self.last_probe = 0.0
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def __repr__(self):
+        return f"Backend({self.url!r}, inflight={self.inflight}, healthy={self.healthy})"
+
+
+class BackendPool:
+    """
+    Routes completion requests across several Ollama servers.
+
+    Each request goes to the healthy backend serving the model with the fewest
+    in-flight requests, preferring backends that already have the model
+    resident. A daemon thread probes /api/ps to track health and residency.
+    Requests are failed over only when they provably never reached a model
+    (the connect failed, or 502/503) and, for streams, before the first byte.
+    Other errors are raised without marking the backend down.
+    """
+    def __init__(self, backends: list, probe_interval: float = PROBE_INTERVAL_SECS):
+        if not backends:
+            raise ValueError("BackendPool needs at least one backend")
+        self.backends       = backends
+        self.probe_interval = probe_interval
+        self._lock          = threading.Lock()
+        self._prober        = None
+
+    @classmethod
+    def from_spec(cls, spec: str, default_url: str = "http://127.0.0.1:11434", **kwargs) -> "BackendPool":
+        """Builds a pool from an OLLAMA_BACKENDS-style spec; an empty spec means just `default_url`."""
+        backends = []
+        for entry in filter(None, (e.strip() for e in spec.split(";"))):
+            url, _, models = entry.partition("=")
+            names = [m.strip() for m in models.split(",") if m.strip() and m.strip() != "*"]
+            backends.append(Backend(url, names or None))
+        return cls(backends or [Backend(default_url)], **kwargs)
+
+    # --- routing ---
+
+    def pick(self, model: str, exclude: Iterable[Backend] = ()) -> Backend:
+        self._ensure_prober()
+        candidates = [b for b in self.backends if b.serves(model) and b not in exclude]
+        if not candidates:
+            raise NoBackendAvailable(f"No backend serves {model}")
+        # Probes can be stale; if nothing looks healthy, try anyway rather than fail outright.
+        healthy = [b for b in candidates if b.healthy] or candidates
+        with self._lock:
+            return min(healthy, key=lambda b: (model not in b.resident, b.inflight))
+
+    @contextmanager
+    def lease(self, model: str, exclude: Iterable[Backend] = ()) -> Generator[Backend, None, None]:
+        """Picks a backend and counts the request as in flight on it for the duration."""
+        with self.lease_backend(self.pick(model, exclude)) as backend:
+            yield backend
+
+    @contextmanager
+    def lease_backend(self, backend: Backend) -> Generator[Backend, None, None]:
+        with self._lock:
+            backend.inflight += 1
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                backend.inflight -= 1
+
+    def mark_down(self, backend: Backend, reason) -> None:
+        logger.warning(f"Backend {backend.url} marked down: {reason}")
+        backend.healthy = False
+
+    def _attempts(self, model: str):
+        """Yields backends to try, in order, until every one serving `model` has failed."""
+        tried = []
+        while True:
+            try:
+                backend = self.pick(model, exclude=tried)
+            except NoBackendAvailable:
+                if tried:
+                    raise NoBackendAvailable(f"All backends failed for {model}")
+                raise
+            tried.append(backend)
+            yield backend
+
+    def post(self, model: str, path: str, payload: dict, timeout: float = 300) -> requests.Response:
+        """Non-streaming POST with failover; returns the response after raise_for_status()."""
+        for backend in self._attempts(model):
+            with self.lease_backend(backend):
+                try:
+                    r = backend.transport.post(path, payload, timeout=timeout)
+                    if r.status_code in _RETRYABLE_STATUS:
+                        raise _Retryable(f"HTTP {r.status_code}")
+                except (requests.ConnectionError, _Retryable) as e:
+                    if not _never_sent(e):
+                        raise
+                    self.mark_down(backend, e)
+                    continue
+                r.raise_for_status()
+                return r
+
+    def stream_lines(self, model: str, path: str, payload: dict, timeout: float = 300,
+                     cancel=None) -> Generator[bytes, None, None]:
+        """
+        Streaming POST yielding raw lines; fails over only before the first line arrives.
+
+        `cancel` (a CancelToken) closes the response from any thread, which
+        drops the connection so the backend stops decoding; the generator
+        then just ends.
+        """
+        for backend in self._attempts(model):
+            if cancel is not None and cancel.cancelled:
+                return
+            with self.lease_backend(backend):
+                started = False
+                try:
+                    with span("http_response_headers"):
+                        r = backend.transport.post(path, payload, stream=True, timeout=timeout)
+                    with r:
+                        if cancel is not None:
+                            cancel.on_cancel(r.close)
+                        if r.status_code in _RETRYABLE_STATUS:
+                            raise _Retryable(f"HTTP {r.status_code}")
+                        r.raise_for_status()
+                        for line in r.iter_lines():
+                            if cancel is not None and cancel.cancelled:
+                                return
+                            started = True
+                            yield line
+                    return
+                except Exception as e:
+                    if cancel is not None and cancel.cancelled:
+                        # Reading a response closed under us
+                        return
+                    if started or not _never_sent(e):
+                        raise
+                    self.mark_down(backend, e)
+
+    # --- health ---
+
+    def probe(self, backend: Backend) -> None:
+        try:
+            r = backend.transport.get("/api/ps", timeout=5)
+            r.raise_for_status()
+            backend.resident = {m["name"]: m.get("size", 0) for m in r.json().get("models", [])}
+            backend.healthy  = True
+        except (requests.RequestException, ValueError) as e:
+            if backend.healthy:
+                self.mark_down(backend, e)
+        backend.last_probe = time.time()
+
+    def _ensure_prober(self) -> None:
+        if self._prober is None and self.probe_interval > 0:
+            with self._lock:
+                if self._prober is None:
+                    self._prober = threading.Thread(target=self._probe_loop, name="backend-probe", daemon=True)
+                    self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            for backend in self.backends:
+                self.probe(backend)
+            time.sleep(self.probe_interval)
+
+    def status(self) -> list:
+        return [
+            {"url": b.url, "healthy": b.healthy, "inflight": b.inflight,
+             "resident": sorted(b.resident), "last_probe": b.last_probe}
+            for b in self.backends
+        ]
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(default_url: str = "http://127.0.0.1:11434") -> BackendPool:
+    """Process-wide pool built from OLLAMA_BACKENDS, or just `default_url` when that is unset."""
+    with _pools_lock:
+        pool = _pools.get(default_url)
+        if pool is None:
+            pool = _pools[default_url] = BackendPool.from_spec(OLLAMA_BACKENDS, default_url)
+        return pool
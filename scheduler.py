@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+# Lower runs first.
+PRIORITY_USER  = 0  # logged-in, interactive
+PRIORITY_ANON  = 1  # anonymous, interactive
+PRIORITY_TITLE = 2  # background title generation
+
+SCHED_DEFAULT_SLOTS = int(os.getenv("SCHED_DEFAULT_SLOTS", "2"))
+SCHED_MODEL_SLOTS   = os.getenv("SCHED_MODEL_SLOTS", "")  # "deepseek-r1:70b=1,llama3.2:3b=6"
+SCHED_USER_LIMIT    = int(os.getenv("SCHED_USER_LIMIT", "2"))
+SCHED_MAX_QUEUE     = int(os.getenv("SCHED_MAX_QUEUE", "16"))
+
+
+class QueueFull(RuntimeError):
+    """Raised when a request is rejected at admission."""
+
+
+def priority_for(logged_in: bool, interactive: bool = True) -> int:
+    if not interactive:
+        return PRIORITY_TITLE
+    return PRIORITY_USER if logged_in else PRIORITY_ANON
+
+
+def _parse_slots(spec: str) -> dict:
+    slots = {}
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        model, _, n = entry.rpartition("=")
+        slots[model] = int(n)
+    return slots
+
+
+class AdmissionScheduler:
+    """
+    Admission control for generation requests.
+
+    Each model has a fixed number of concurrent slots. Requests beyond that
+    wait in a bounded per-model priority queue (then FIFO within a priority).
+    A user may hold at most `user_limit` running-or-queued requests. Anything
+    over a limit is rejected with QueueFull instead of slowing everyone down.
+    """
+    def __init__(self, model_slots: dict = None, default_slots: int = SCHED_DEFAULT_SLOTS,
+                 user_limit: int = SCHED_USER_LIMIT, max_queue: int = SCHED_MAX_QUEUE):
+        self.model_slots   = model_slots if model_slots is not None else _parse_slots(SCHED_MODEL_SLOTS)
+        self.default_slots = default_slots
+        self.user_limit    = user_limit
+        self.max_queue     = max_queue
+        self._cond    = threading.Condition()
+        self._active  = {}  # model -> running count
+        self._queues  = {}  # model -> heap of (priority, seq)
+        self._users   = {}  # user -> running + queued count
+        self._seq     = itertools.count()
+
+    def slots(self, model: str) -> int:
+        return self.model_slots.get(model, self.default_slots)
+
+    def _position(self, model: str, entry: tuple) -> int:
+        """1-based position of `entry` in the model's queue."""
+        return sum(1 for e in self._queues[model] if e < entry) + 1
+
+    @contextmanager
+    def slot(self, model: str, user: str | None = None, priority: int = PRIORITY_USER,
+             on_wait: Callable[[int], None] = None, timeout: float = None):
+        """
+        Holds a generation slot for `model` for the duration of the block.
+
+        While queued, on_wait(position) is called (outside the scheduler lock,
+        so it may be slow or raise) whenever the position changes. Raises QueueFull if the user or the queue is over
+        its limit, or if `timeout` seconds pass without a slot.
+        """
+        self._admit(model, user, priority, on_wait, timeout)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[model] -= 1
+                self._release_user(user)
+                self._cond.notify_all()
+
+    def _admit(self, model, user, priority, on_wait, timeout) -> None:
+        with self._cond:
+            if user is not None and self._users.get(user, 0) >= self.user_limit:
+                raise QueueFull(f"You already have {self.user_limit} generations running; wait for one to finish.")
+            queue = self._queues.setdefault(model, [])
+            running = self._active.get(model, 0)
+            if running < self.slots(model) and not queue:
+                self._active[model] = running + 1
+                self._take_user(user)
+                return
+            if len(queue) >= self.max_queue:
+                raise QueueFull(f"{model} is at capacity ({len(queue)} requests queued); try again shortly.")
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(queue, entry)
+            self._take_user(user)
+            last_pos = None
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                while not (queue[0] == entry and self._active.get(model, 0) < self.slots(model)):
+                    pos = self._position(model, entry)
+                    if on_wait and pos != last_pos:
+                        last_pos = pos
+                        # A UI callback must not stall every other admission and release
+                        self._cond.release()
+                        try:
+                            on_wait(pos)
+                        finally:
+                            self._cond.acquire()
+                        # Slots may have been released meanwhile: re-check before waiting
+                        continue
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if (remaining is not None and remaining <= 0) or not self._cond.wait(remaining):
+                        raise QueueFull(f"Timed out waiting for {model}.")
+            except BaseException:
+                queue.remove(entry)
+                heapq.heapify(queue)
+                self._release_user(user)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(queue)
+            self._active[model] = self._active.get(model, 0) + 1
+            # Others may now be at the head, or have moved up
+            self._cond.notify_all()
+
+    def _take_user(self, user):
+        if user is not None:
+            self._users[user] = self._users.get(user, 0) + 1
+
+    def _release_user(self, user):
+        if user is not None:
+            self._users[user] -= 1
+            if not self._users[user]:
+                del self._users[user]
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                model: {"active": self._active.get(model, 0), "queued": len(self._queues.get(model, [])),
+                        "slots": self.slots(model)}
+                for model in set(self._active) | set(self._queues)
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> AdmissionScheduler:
+    """Process-wide scheduler shared by every Streamlit session."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = AdmissionScheduler()
+        return _scheduler
@@ -0,0 +1,178 @@
+"""
+Single-flight coalescing of identical in-flight completions.
+
+The first request for a key starts one upstream generation, read on a
+background thread into a buffer; identical requests arriving while it runs
+attach to it instead of starting their own. Every subscriber is replayed
+the buffered prefix, then follows the live stream, so a double-submit or a
+popular prompt costs one generation on the GPU.
+
+Subscribers leave independently (cancel or close); the upstream is only
+stopped once the last one has left. The generation's token usage is charged
+to exactly one subscriber: one still attached when it ends, or the last to
+leave if it was stopped. A finished flight is dropped at once:
+later requests go to the response cache (deterministic settings) or the
+backend, never to a stale buffer.
+"""
+import logging
+import os
+import threading
+from typing import Callable, Generator, Iterator
+from cache import CompletionCache
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "1") == "1"
+
+
+class Flight:
+    """One upstream generation and every delta it has produced so far."""
+    def __init__(self, key: str):
+        self.key         = key
+        self.deltas      = []
+        self.ended       = False
+        self.error       = None
+        self.subscribers = 0
+        self.stop        = None   # stops the upstream; set by the leader's start()
+        self.usage       = {}     # filled by the upstream; see follow()
+        self.charged     = False
+        self.cond        = threading.Condition()
+
+
+class SingleFlight:
+    """
+    Registry of in-flight generations by key.
+
+        flight, leader = flights.join(key, start)
+        for delta in flights.follow(flight, cancel, usage):
+            ...
+
+    start(flight) is called once, by the request that creates the flight,
+    and returns (iterator of deltas, stop callable or None); the iterator is
+    drained on a daemon thread and records token usage in flight.usage.
+    """
+    def __init__(self):
+        self._flights = {}
+        self._lock    = threading.Lock()
+        self.stats    = {"flights": 0, "joined": 0}
+
+    @staticmethod
+    def key(payload: dict) -> str:
+        # Same fields as the response cache, plus the mode: a streamed and a
+        # non-streamed request never share a flight
+        return ("stream:" if payload.get("stream") else "complete:") + CompletionCache.key(payload)
+
+    def join(self, key: str, start: Callable[[Flight], tuple]) -> tuple:
+        """(flight, leader): attaches to the flight for `key`, starting it if there is none."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.subscribers += 1
+                self.stats["joined"] += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            flight.subscribers = 1
+            self.stats["flights"] += 1
+        try:
+            source, flight.stop = start(flight)
+        except BaseException as e:
+            self._end(flight, e)
+            raise
+        threading.Thread(target=self._pump, args=(flight, source), name="singleflight", daemon=True).start()
+        return flight, True
+
+    def follow(self, flight: Flight, cancel=None, usage: dict = None) -> Generator[str, None, None]:
+        """
+        The flight's deltas from the first one: the buffered prefix, then live.
+        Re-raises the upstream's error. Ends quietly once `cancel` fires;
+        closing or cancelling detaches this subscriber only.
+
+        If this subscriber is the one charged for the generation, flight.usage
+        is copied into `usage` by the time the generator ends. Subscribers that
+        pass no `usage` are never charged.
+        """
+        if cancel is not None:
+            cancel.on_cancel(lambda: self._wake(flight))
+        i = 0
+        try:
+            while True:
+                with flight.cond:
+                    while i == len(flight.deltas) and not flight.ended and not (cancel and cancel.cancelled):
+                        flight.cond.wait()
+                    if cancel is not None and cancel.cancelled:
+                        return
+                    pending, ended = flight.deltas[i:], flight.ended
+                i += len(pending)
+                yield from pending
+                if ended and i == len(flight.deltas):
+                    self._charge(flight, usage)
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            self._leave(flight, usage)
+
+    @staticmethod
+    def _wake(flight: Flight) -> None:
+        with flight.cond:
+            flight.cond.notify_all()
+
+    def _charge(self, flight: Flight, usage: dict | None) -> None:
+        if usage is None:
+            return
+        with self._lock:
+            if flight.charged:
+                return
+            flight.charged = True
+        usage.update(flight.usage)
+
+    def _leave(self, flight: Flight, usage: dict = None) -> None:
+        with self._lock:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers == 0 and not flight.ended
+            if abandoned and self._flights.get(flight.key) is flight:
+                # New requests must not attach to a flight that is being stopped
+                del self._flights[flight.key]
+        if abandoned:
+            # Last one out stops the generation, and pays for what was decoded
+            self._charge(flight, usage)
+            if flight.stop is not None:
+                flight.stop()
+
+    def _pump(self, flight: Flight, source: Iterator[str]) -> None:
+        error = None
+        try:
+            for delta in source:
+                with flight.cond:
+                    flight.deltas.append(delta)
+                    flight.cond.notify_all()
+        except Exception as e:
+            logger.debug(f"Coalesced generation failed: {e}")
+            error = e
+        self._end(flight, error)
+
+    def _end(self, flight: Flight, error: BaseException = None) -> None:
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        with flight.cond:
+            flight.error = error
+            flight.ended = True
+            flight.cond.notify_all()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+
+_flights = None
+_flights_lock = threading.Lock()
+
+
+def get_singleflight() -> SingleFlight:
+    """Process-wide registry shared by every ChatClient."""
+    global _flights
+    with _flights_lock:
+        if _flights is None:
+            _flights = SingleFlight()
+        return _flights
@@ -1,84 +1,434 @@
 import sqlite3
 import os
-from datetime import datetime
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import codec
+from db import Database, get_database
+from maintenance import Maintenance
+from metrics import span, timed
 
-DB_FILE = os.getenv("CHAT_DB_PATH", "chat_history.db")
+logger = logging.getLogger(__name__)
 
-class StorageManager:
+WRITE_BEHIND = os.getenv("CHAT_DB_WRITE_BEHIND", "0") == "1"
+ANONYMOUS    = "anonymous"  # owner of chats created while logged out, and of chats predating owners
+ARCHIVE_AFTER_DAYS = float(os.getenv("CHAT_DB_ARCHIVE_AFTER_DAYS", "90"))  # 0 = never archive
+ARCHIVE_DIR        = os.getenv("CHAT_DB_ARCHIVE_DIR")  # default: next to the database
+
+
+class WriteBehindQueue:
     """
-    Manages chat sessions and messages using SQLite, with auto-recovery and persistent titles.
+    Background thread that drains queued statements and group-commits them
+    through the database's writer connection.
 
-    Tables:
-      - chats(chat_id TEXT PRIMARY KEY, created_at TEXT, title TEXT)
-      - messages(msg_id INT PRIMARY KEY AUTOINCREMENT, chat_id TEXT, role TEXT, content TEXT, timestamp TEXT)
+    A batch is committed once `max_batch` statements are queued or
+    `flush_interval_ms` has passed since the first one, whichever comes first.
+    flush() is a barrier: it returns once everything queued before it is committed.
     """
-    def __init__(self, db_path: str = None):
-        self.db_path = db_path or DB_FILE
-        self._connect_and_init()
+    def __init__(self, db: Database, flush_interval_ms: int = 20, max_batch: int = 256):
+        self.db       = db
+        self.interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self._queue   = queue.Queue()
+        self._pending = 0
+        self._lock    = threading.Lock()
+        self._thread  = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, sql: str, params: tuple) -> None:
+        with self._lock:
+            self._pending += 1
+        self._queue.put((sql, params))
+
+    def put_many(self, statements: list) -> None:
+        """Queues [(sql, params), ...] to be committed together, in one transaction."""
+        with self._lock:
+            self._pending += 1
+        self._queue.put(list(statements))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Blocks until all previously queued writes are committed. Returns False on timeout."""
+        with self._lock:
+            if not self._pending:
+                return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
 
-    def _connect_and_init(self):
+    def close(self) -> None:
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, barriers, stop = [], [], False
+            deadline = time.monotonic() + self.interval
+            while True:
+                if isinstance(item, threading.Event):
+                    barriers.append(item)
+                elif item is None:
+                    stop = True
+                    break
+                else:
+                    batch.append(item)
+                if len(batch) >= self.max_batch or barriers:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+            for b in barriers:
+                b.set()
+            if stop:
+                return
+
+    def _commit(self, batch: list) -> None:
+        if not batch:
+            return
         try:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            self.conn.execute("PRAGMA journal_mode=WAL;")
-            self.conn.execute("PRAGMA synchronous=NORMAL;")
-            cur = self.conn.cursor()
-            cur.execute("PRAGMA integrity_check;")
-            if cur.fetchone()[0] != 'ok':
-                raise sqlite3.DatabaseError("Integrity check failed")
-        except (sqlite3.DatabaseError, sqlite3.OperationalError):
-            try: self.conn.close()
-            except: pass
-            corrupt = self.db_path + ".corrupt"
-            if os.path.exists(self.db_path):
-                os.replace(self.db_path, corrupt)
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            self.conn.execute("PRAGMA journal_mode=WAL;")
-            self.conn.execute("PRAGMA synchronous=NORMAL;")
+            with span("group_commit"), self.db.write() as conn:
+                for item in batch:
+                    for sql, params in _statements(item):
+                        conn.execute(sql, params)
+        except sqlite3.Error as e:
+            # Fall back to row-at-a-time so one bad row doesn't lose the batch
+            logger.warning(f"Batch commit failed ({e}); retrying {len(batch)} writes individually")
+            for item in batch:
+                try:
+                    with self.db.write() as conn:
+                        for sql, params in _statements(item):
+                            conn.execute(sql, params)
+                except sqlite3.Error as row_err:
+                    logger.error(f"Dropped write {item!r}: {row_err}")
         finally:
-            self._init_db()
+            with self._lock:
+                self._pending -= len(batch)
+
+
+def _statements(item) -> list:
+    """A queued write: one (sql, params) or a put_many() list of them."""
+    return item if isinstance(item, list) else [item]
+
+
+def _migrate_base_tables(conn: sqlite3.Connection) -> None:
+    # Create chats table
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id    TEXT PRIMARY KEY,
+            created_at TEXT,
+            title      TEXT
+        );
+    """)
+    # Create messages table
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            msg_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id    TEXT,
+            role       TEXT,
+            content    TEXT,
+            timestamp  TEXT,
+            FOREIGN KEY(chat_id) REFERENCES chats(chat_id)
+        );
+    """)
+
+
+def _migrate_indexes(conn: sqlite3.Connection) -> None:
+    # fetch_history / keyset paging: seek by chat, walk msg_id in order
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, msg_id);")
+    # fetch_thinking: only the assistant_think rows of one chat
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_role ON messages(chat_id, role, msg_id);")
+    # list_chats: covering, newest first
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_created ON chats(created_at, chat_id, title);")
+
+
+def _migrate_search(conn: sqlite3.Connection) -> None:
+    # Full-text index over user/assistant messages. External-content table,
+    # so the text itself is stored once (in messages). Reasoning is not indexed.
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content, content='messages', content_rowid='msg_id', tokenize='unicode61'
+        );
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages
+        WHEN new.role != 'assistant_think' BEGIN
+            INSERT INTO messages_fts(rowid, content) VALUES (new.msg_id, new.content);
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages
+        WHEN old.role != 'assistant_think' BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.msg_id, old.content);
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages
+        WHEN old.role != 'assistant_think' BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.msg_id, old.content);
+            INSERT INTO messages_fts(rowid, content) VALUES (new.msg_id, new.content);
+        END;
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);")
+    # Rows that predate the triggers are indexed by backfill_search_index().
+    conn.execute(
+        "INSERT OR REPLACE INTO meta(key, value) "
+        "SELECT 'fts_backfill_upto', COALESCE(MAX(msg_id), 0) FROM messages;"
+    )
+    conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('fts_backfill_done', 0);")
+
+
+def _migrate_compression(conn: sqlite3.Connection) -> None:
+    # Large bodies (see codec.py): content is NULL and body holds `codec`-compressed
+    # text of raw_size bytes. Existing rows are rewritten by compress_existing().
+    conn.execute("ALTER TABLE messages ADD COLUMN body BLOB;")
+    conn.execute("ALTER TABLE messages ADD COLUMN codec TEXT;")
+    conn.execute("ALTER TABLE messages ADD COLUMN raw_size INTEGER;")
+
+
+def _migrate_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    # Only records the mode: the tables already exist by now. A new file gets it
+    # from _init_db before migration 1; an older one needs a full VACUUM,
+    # which Maintenance runs when idle (small files) or on request.
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+
+
+def _migrate_archive(conn: sqlite3.Connection) -> None:
+    # Set on stub rows of chats whose messages were moved to a monthly archive file
+    conn.execute("ALTER TABLE chats ADD COLUMN archived TEXT;")
+    # Opening a chat counts as activity, so a restored chat is not archived again right away
+    conn.execute("ALTER TABLE chats ADD COLUMN restored_at TEXT;")
+
+
+def _migrate_owner(conn: sqlite3.Connection) -> None:
+    # ADD COLUMN with a default fills existing rows without rewriting the table
+    conn.execute(f"ALTER TABLE chats ADD COLUMN owner TEXT NOT NULL DEFAULT '{ANONYMOUS}';")
+    # list_chats(owner): covering, newest first within one owner
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_owner_created ON chats(owner, created_at, chat_id, title);")
+    # Chats per owner, kept by triggers so counting never scans chats
+    conn.execute("CREATE TABLE IF NOT EXISTS chat_counts (owner TEXT PRIMARY KEY, chats INTEGER NOT NULL);")
+    conn.execute("INSERT INTO chat_counts(owner, chats) SELECT owner, COUNT(*) FROM chats GROUP BY owner;")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_counts_ai AFTER INSERT ON chats BEGIN
+            INSERT INTO chat_counts(owner, chats) VALUES (new.owner, 1)
+            ON CONFLICT(owner) DO UPDATE SET chats = chats + 1;
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_counts_ad AFTER DELETE ON chats BEGIN
+            UPDATE chat_counts SET chats = chats - 1 WHERE owner = old.owner;
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_counts_au AFTER UPDATE OF owner ON chats
+        WHEN old.owner != new.owner BEGIN
+            UPDATE chat_counts SET chats = chats - 1 WHERE owner = old.owner;
+            INSERT INTO chat_counts(owner, chats) VALUES (new.owner, 1)
+            ON CONFLICT(owner) DO UPDATE SET chats = chats + 1;
+        END;
+    """)
+
+
+def _migrate_usage(conn: sqlite3.Connection) -> None:
+    # Set on assistant rows that came from a live generation (not the response cache)
+    conn.execute("ALTER TABLE messages ADD COLUMN model TEXT;")
+    conn.execute("ALTER TABLE messages ADD COLUMN prompt_tokens INTEGER;")
+    conn.execute("ALTER TABLE messages ADD COLUMN completion_tokens INTEGER;")
+    conn.execute("ALTER TABLE messages ADD COLUMN duration_ms INTEGER;")
+    # Running totals, updated in the same transaction as the message. Not a trigger
+    # on messages: archiving and restoring re-insert rows that were already counted.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            day               TEXT NOT NULL,
+            owner             TEXT NOT NULL,
+            model             TEXT NOT NULL,
+            requests          INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens     INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            duration_ms       INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, owner, model)
+        ) WITHOUT ROWID;
+    """)
+
+
+def _migrate_fts_backfill_guard(conn: sqlite3.Connection) -> None:
+    # An FTS5 'delete' of a row that was never indexed corrupts the index, and rows
+    # in (fts_backfill_done, fts_backfill_upto] are not indexed until the backfill
+    # reaches them; deleting or rewriting them (archiving, import) touches the
+    # index only for rows already in it. The backfill reads messages, so it
+    # indexes their current text later.
+    indexed = (
+        "old.role != 'assistant_think' AND ("
+        "old.msg_id > (SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'fts_backfill_upto') OR "
+        "old.msg_id <= (SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'fts_backfill_done'))"
+    )
+    conn.execute("DROP TRIGGER IF EXISTS messages_fts_ad;")
+    conn.execute("DROP TRIGGER IF EXISTS messages_fts_au;")
+    conn.execute(f"""
+        CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages
+        WHEN {indexed} BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.msg_id, old.content);
+        END;
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER messages_fts_au AFTER UPDATE OF content ON messages
+        WHEN {indexed} BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.msg_id, old.content);
+            INSERT INTO messages_fts(rowid, content) VALUES (new.msg_id, new.content);
+        END;
+    """)
+
+
+def _fts_query(text: str) -> str:
+    """Turns free text into a safe FTS5 query: every word quoted, the last one prefix-matched."""
+    terms = ['"' + t.replace('"', '""') + '"' for t in text.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+# Schema migrations, applied in order. MIGRATIONS[i] upgrades user_version i -> i + 1.
+# Append only; never edit a migration that has shipped.
+MIGRATIONS = [
+    _migrate_base_tables,
+    _migrate_indexes,
+    _migrate_search,
+    _migrate_compression,
+    _migrate_incremental_vacuum,
+    _migrate_archive,
+    _migrate_owner,
+    _migrate_usage,
+    _migrate_fts_backfill_guard,
+]
+
+
+class StorageManager:
+    """
+    Manages chat sessions and messages using SQLite, with auto-recovery and persistent titles.
+
+    Tables:
+      - chats(chat_id TEXT PRIMARY KEY, created_at TEXT, title TEXT, archived TEXT, restored_at TEXT,
+              owner TEXT)
+      - messages(msg_id INT PRIMARY KEY AUTOINCREMENT, chat_id TEXT, role TEXT, content TEXT, timestamp TEXT,
+                 body BLOB, codec TEXT, raw_size INTEGER,
+                 model TEXT, prompt_tokens INTEGER, completion_tokens INTEGER, duration_ms INTEGER)
+      - usage_daily(day, owner, model, requests, prompt_tokens, completion_tokens, duration_ms)
+
+    Every chat belongs to an owner (a username, or ANONYMOUS); listing and
+    search are scoped to one owner, and chat_counts holds per-owner totals.
+
+    Assistant messages carry the generation's token counts and duration;
+    usage_daily sums them per day, owner and model for quotas (usage.py)
+    and reporting.
+
+    Chats idle for ARCHIVE_AFTER_DAYS have their messages moved to monthly
+    archive files (archive_idle_chats); the chats row stays as a stub with
+    `archived` set, and opening the chat moves it back (restore_chat).
+    Archived chats are not searchable until restored.
+
+    Large reasoning bodies are stored compressed in `body` (codec.py) and
+    decompressed on read; queries that leave reasoning out never touch them.
+
+    The schema is versioned through PRAGMA user_version; see MIGRATIONS.
+    Connections come from the process-wide Database (db.py): reads use this
+    thread's read-only connection and never wait on writers.
+
+    In write-behind mode writes are group-committed by a WriteBehindQueue and
+    every read flushes first, so a manager always sees its own writes.
+    """
+    def __init__(self, db_path: str = None, write_behind: bool = None, durability: str = None,
+                 flush_interval_ms: int = 20, max_batch: int = 256):
+        """
+        write_behind: queue create_chat/set_chat_title/append_message on a writer
+          thread that group-commits them (default from CHAT_DB_WRITE_BEHIND).
+        durability: 'off' | 'normal' | 'full', mapped to PRAGMA synchronous
+          (default from CHAT_DB_DURABILITY; applies to the shared database).
+        """
+        self.db      = get_database(db_path)
+        self.db_path = self.db.path
+        if durability is not None:
+            self.db.set_durability(durability)
+        self._init_db()
+        self.maintenance = Maintenance(self)
+        self.writer = None
+        if WRITE_BEHIND if write_behind is None else write_behind:
+            self.writer = WriteBehindQueue(self.db, flush_interval_ms, max_batch)
 
     def _init_db(self):
-        c = self.conn.cursor()
-        # Create chats table
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS chats (
-                chat_id    TEXT PRIMARY KEY,
-                created_at TEXT,
-                title      TEXT
-            );
-        """)
-        # Create messages table
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                msg_id     INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id    TEXT,
-                role       TEXT,
-                content    TEXT,
-                timestamp  TEXT,
-                FOREIGN KEY(chat_id) REFERENCES chats(chat_id)
-            );
-        """)
-        self.conn.commit()
-
-    def create_chat(self, chat_id: str) -> None:
+        """
+        Brings the schema up to date by running every migration newer than
+        the database's PRAGMA user_version, each in its own transaction.
+        """
+        with self.db.write() as conn:
+            version = conn.execute("PRAGMA user_version;").fetchone()[0]
+            empty = conn.execute("SELECT count(*) FROM sqlite_master;").fetchone()[0] == 0
+            if empty:
+                # The WAL switch has already written the header, so even a new file
+                # needs a VACUUM to apply auto_vacuum; it is instant while there are
+                # no tables. Files that predate migrations are left to Maintenance,
+                # which only rewrites them when small enough.
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+                conn.execute("VACUUM;")
+        for target, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+            with self.db.write() as conn:
+                # sqlite3 only opens transactions for DML: without this, each
+                # CREATE/ALTER would commit alone and a failed migration would
+                # leave a half-applied schema behind
+                conn.execute("BEGIN;")
+                migrate(conn)
+                # PRAGMA does not take bound parameters
+                conn.execute(f"PRAGMA user_version={target};")
+
+    def _write(self, sql: str, params: tuple) -> None:
+        self.maintenance.touch()
+        if self.writer is not None:
+            self.writer.put(sql, params)
+            return
+        with self.db.write() as conn:
+            conn.execute(sql, params)
+
+    def _write_many(self, statements: list) -> None:
+        """Like _write, for [(sql, params), ...] that must commit together."""
+        self.maintenance.touch()
+        if self.writer is not None:
+            self.writer.put_many(statements)
+            return
+        with self.db.write() as conn:
+            for sql, params in statements:
+                conn.execute(sql, params)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Barrier for write-behind mode: returns once every write queued so far is
+        committed. A no-op when writes are synchronous.
+        """
+        if self.writer is None:
+            return True
+        return self.writer.flush(timeout)
+
+    def create_chat(self, chat_id: str, owner: str = None) -> None:
         now = datetime.utcnow().isoformat()
-        c = self.conn.cursor()
-        c.execute(
-            "INSERT OR IGNORE INTO chats(chat_id, created_at) VALUES(?, ?)",
-            (chat_id, now)
+        self._write(
+            "INSERT OR IGNORE INTO chats(chat_id, created_at, owner) VALUES(?, ?, ?)",
+            (chat_id, now, owner or ANONYMOUS)
         )
-        self.conn.commit()
 
     def set_chat_title(self, chat_id: str, title: str) -> None:
-        c = self.conn.cursor()
-        c.execute(
+        self._write(
             "UPDATE chats SET title = ? WHERE chat_id = ?",
             (title, chat_id)
         )
-        self.conn.commit()
 
     def get_chat_title(self, chat_id: str) -> str | None:
-        c = self.conn.cursor()
+        self.flush()
+        c = self.db.reader().cursor()
         c.execute(
             "SELECT title FROM chats WHERE chat_id = ?",
             (chat_id,)
@@ -86,49 +436,634 @@ class StorageManager:
         row = c.fetchone()
         return row[0] if row and row[0] else None
 
-    def append_message(self, chat_id: str, role: str, content: str) -> None:
+    @timed("append_message")
+    def append_message(self, chat_id: str, role: str, content: str, usage: dict = None) -> None:
         """
         role can be 'user', 'assistant', or now also 'assistant_think'
+
+        usage: {'model', 'prompt_tokens', 'completion_tokens', 'duration_ms'} of
+          the generation that produced this message; stored on the row and
+          added to usage_daily in the same transaction, under usage['owner']
+          if given (who made the request), else the chat's owner.
         """
+        self._ensure_hot(chat_id)
         now = datetime.utcnow().isoformat()
-        c = self.conn.cursor()
-        c.execute(
-            "INSERT INTO messages(chat_id, role, content, timestamp) VALUES(?, ?, ?, ?)",
-            (chat_id, role, content, now)
-        )
-        self.conn.commit()
+        text, body, tag, raw_size = codec.encode(role, content)
+        if not usage:
+            self._write(
+                "INSERT INTO messages(chat_id, role, content, timestamp, body, codec, raw_size) VALUES(?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, role, text, now, body, tag, raw_size)
+            )
+            return
+        counts = (usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0, usage.get("duration_ms") or 0)
+        self._write_many([
+            (
+                "INSERT INTO messages(chat_id, role, content, timestamp, body, codec, raw_size, "
+                "model, prompt_tokens, completion_tokens, duration_ms) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, role, text, now, body, tag, raw_size, usage["model"], *counts)
+            ),
+            (
+                # "WHERE true" lets the upsert clause parse after INSERT ... SELECT
+                "INSERT INTO usage_daily(day, owner, model, requests, prompt_tokens, completion_tokens, duration_ms) "
+                f"SELECT ?, COALESCE(?, (SELECT owner FROM chats WHERE chat_id = ?), '{ANONYMOUS}'), ?, 1, ?, ?, ? "
+                "WHERE true ON CONFLICT(day, owner, model) DO UPDATE SET "
+                "requests = requests + 1, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                "duration_ms = duration_ms + excluded.duration_ms",
+                (now[:10], usage.get("owner"), chat_id, usage["model"], *counts)
+            ),
+        ])
 
-    def fetch_history(self, chat_id: str) -> list:
+    @timed("fetch_history")
+    def fetch_history(self, chat_id: str, include_reasoning: bool = True) -> list:
         """
-        Returns all messages in order, including assistant_think entries.
+        Returns all messages in order, including assistant_think entries
+        unless include_reasoning=False (which skips them in the query).
         """
-        c = self.conn.cursor()
+        self.flush()
+        self._ensure_hot(chat_id)
+        c = self.db.reader().cursor()
+        if include_reasoning:
+            c.execute(
+                "SELECT role, content, body, codec FROM messages WHERE chat_id = ? ORDER BY msg_id ASC",
+                (chat_id,)
+            )
+            return [{"role": r, "content": codec.decode(t, b, k)} for r, t, b, k in c.fetchall()]
         c.execute(
-            "SELECT role, content FROM messages WHERE chat_id = ? ORDER BY msg_id ASC",
+            "SELECT role, content FROM messages WHERE chat_id = ? AND role != 'assistant_think' ORDER BY msg_id ASC",
             (chat_id,)
         )
-        return [{"role": r, "content": c} for r, c in c.fetchall()]
+        return [{"role": r, "content": t} for r, t in c.fetchall()]
 
+    @timed("fetch_thinking")
     def fetch_thinking(self, chat_id: str) -> list:
         """
         Returns only the reasoning steps (assistant_think messages) for this chat.
         """
-        c = self.conn.cursor()
+        self.flush()
+        self._ensure_hot(chat_id)
+        c = self.db.reader().cursor()
         c.execute(
-            "SELECT content FROM messages WHERE chat_id = ? AND role = 'assistant_think' ORDER BY msg_id ASC",
+            "SELECT content, body, codec FROM messages WHERE chat_id = ? AND role = 'assistant_think' ORDER BY msg_id ASC",
             (chat_id,)
         )
-        return [row[0] for row in c.fetchall()]
+        return [codec.decode(*row) for row in c.fetchall()]
+
+    def get_chat(self, chat_id: str, owner: str = None) -> tuple | None:
+        """(chat_id, created_at, title) like a list_chats row, if `owner` (default ANONYMOUS) has that chat."""
+        self.flush()
+        return self.db.reader().execute(
+            "SELECT chat_id, created_at, title FROM chats WHERE chat_id = ? AND owner = ?",
+            (chat_id, owner or ANONYMOUS)
+        ).fetchone()
 
-    def list_chats(self) -> list:
-        c = self.conn.cursor()
+    def list_chats(self, owner: str = None, limit: int = None, cursor: tuple = None) -> list:
+        """
+        `owner`'s chats (default ANONYMOUS), newest first. With `limit`, one
+        page; `cursor` is the (created_at, chat_id) of the last row of the
+        previous page.
+        """
+        if limit is not None:
+            return self.list_chats_page(limit, before=cursor, owner=owner)
+        self.flush()
+        c = self.db.reader().cursor()
         c.execute(
-            "SELECT chat_id, created_at, title FROM chats ORDER BY created_at DESC"
+            "SELECT chat_id, created_at, title FROM chats WHERE owner = ? ORDER BY created_at DESC",
+            (owner or ANONYMOUS,)
         )
         return c.fetchall()
 
-    def close(self):
+    def list_chats_page(self, limit: int = 50, before: tuple = None, after: tuple = None,
+                        owner: str = None) -> list:
+        """
+        Keyset-paginated list_chats for `owner` (default ANONYMOUS), newest first.
+
+        Cursors are (created_at, chat_id) of a boundary row: `before` returns the
+        next `limit` older chats, `after` the `limit` newer ones.
+        """
+        self.flush()
+        owner = owner or ANONYMOUS
+        c = self.db.reader().cursor()
+        if after is not None:
+            c.execute(
+                "SELECT chat_id, created_at, title FROM chats WHERE owner = ? AND (created_at, chat_id) > (?, ?) "
+                "ORDER BY created_at ASC, chat_id ASC LIMIT ?",
+                (owner, *after, limit)
+            )
+            return c.fetchall()[::-1]
+        if before is not None:
+            c.execute(
+                "SELECT chat_id, created_at, title FROM chats WHERE owner = ? AND (created_at, chat_id) < (?, ?) "
+                "ORDER BY created_at DESC, chat_id DESC LIMIT ?",
+                (owner, *before, limit)
+            )
+        else:
+            c.execute(
+                "SELECT chat_id, created_at, title FROM chats WHERE owner = ? "
+                "ORDER BY created_at DESC, chat_id DESC LIMIT ?",
+                (owner, limit)
+            )
+        return c.fetchall()
+
+    def count_chats(self, owner: str = None) -> int:
+        """Number of chats `owner` has, from the trigger-maintained chat_counts table."""
+        self.flush()
+        row = self.db.reader().execute(
+            "SELECT chats FROM chat_counts WHERE owner = ?", (owner or ANONYMOUS,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_chat_owner(self, chat_id: str) -> str:
+        self.flush()
+        row = self.db.reader().execute("SELECT owner FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row[0] if row else ANONYMOUS
+
+    # --- usage ---
+
+    def tokens_used(self, owner: str = None, day: str = None) -> int:
+        """Prompt + completion tokens `owner` used on `day` (YYYY-MM-DD, default today UTC), all models."""
+        self.flush()
+        day = day or datetime.utcnow().date().isoformat()
+        row = self.db.reader().execute(
+            "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM usage_daily "
+            "WHERE day = ? AND owner = ?", (day, owner or ANONYMOUS)
+        ).fetchone()
+        return row[0]
+
+    def usage_report(self, since: str = None, until: str = None, by: tuple = ("owner", "model")) -> list:
+        """
+        usage_daily totals for days in [since, until] (YYYY-MM-DD, both optional),
+        grouped by any of 'day', 'owner', 'model'; heaviest first.
+        """
+        keys = [k for k in by if k in ("day", "owner", "model")]
+        if len(keys) != len(by):
+            raise ValueError(f"usage_report groups by day, owner or model, not {by!r}")
+        clauses, params = [], []
+        if since:
+            clauses.append("day >= ?"); params.append(since)
+        if until:
+            clauses.append("day <= ?"); params.append(until)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        cols = ", ".join(keys)
+        self.flush()
+        c = self.db.reader().execute(
+            f"SELECT {cols + ', ' if cols else ''}SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), "
+            f"SUM(duration_ms) FROM usage_daily {where}"
+            + (f"GROUP BY {cols} " if cols else "")
+            + "ORDER BY SUM(prompt_tokens + completion_tokens) DESC", params
+        )
+        return [
+            {**dict(zip(keys, row)), "requests": row[-4] or 0, "prompt_tokens": row[-3] or 0,
+             "completion_tokens": row[-2] or 0, "duration_ms": row[-1] or 0}
+            for row in c.fetchall()
+        ]
+
+    @timed("fetch_history_page")
+    def fetch_history_page(self, chat_id: str, limit: int = 50, before: int = None, after: int = None,
+                           include_reasoning: bool = True) -> list:
+        """
+        Keyset-paginated fetch_history in chronological order, with msg_id included.
+
+        Without cursors returns the latest `limit` messages; `before` / `after`
+        are msg_ids and return the `limit` messages immediately older / newer.
+        With include_reasoning=False, assistant_think rows come back with
+        content None; load them on demand with fetch_message.
+        """
+        self.flush()
+        self._ensure_hot(chat_id)
+        # Without reasoning, compressed bodies are never read, let alone decompressed
+        content = "content, body, codec" if include_reasoning else \
+            "CASE WHEN role = 'assistant_think' THEN NULL ELSE content END, NULL, NULL"
+        c = self.db.reader().cursor()
+        if after is not None:
+            c.execute(
+                f"SELECT msg_id, role, {content} FROM messages WHERE chat_id = ? AND msg_id > ? "
+                "ORDER BY msg_id ASC LIMIT ?",
+                (chat_id, after, limit)
+            )
+            rows = c.fetchall()
+        else:
+            c.execute(
+                f"SELECT msg_id, role, {content} FROM messages WHERE chat_id = ? AND msg_id < ? "
+                "ORDER BY msg_id DESC LIMIT ?",
+                (chat_id, before if before is not None else 2**63 - 1, limit)
+            )
+            rows = c.fetchall()[::-1]
+        return [{"msg_id": i, "role": r, "content": codec.decode(t, b, k)} for i, r, t, b, k in rows]
+
+    def fetch_message(self, msg_id: int) -> str | None:
+        """Content of a single message, e.g. a reasoning body opened in the UI."""
+        self.flush()
+        row = self.db.reader().execute(
+            "SELECT content, body, codec FROM messages WHERE msg_id = ?", (msg_id,)
+        ).fetchone()
+        return codec.decode(*row) if row else None
+
+    def search_messages(self, query: str, user: str = None, limit: int = 20, cursor: int = 0) -> tuple:
+        """
+        Full-text search over the user/assistant messages of `user`'s chats
+        (default ANONYMOUS), best matches first.
+
+        Returns (results, next_cursor); next_cursor is None on the last page.
+        Each result has msg_id, chat_id, role, title, snippet and rank.
+        """
+        match = _fts_query(query)
+        if not match:
+            return [], None
+        self.flush()
+        c = self.db.reader().cursor()
+        c.execute(
+            """
+            SELECT m.msg_id, m.chat_id, m.role, ch.title,
+                   snippet(messages_fts, 0, '**', '**', '…', 12), f.rank
+            FROM messages_fts f
+            JOIN messages m ON m.msg_id = f.rowid
+            JOIN chats ch ON ch.chat_id = m.chat_id
+            WHERE messages_fts MATCH ? AND ch.owner = ?
+            ORDER BY f.rank
+            LIMIT ? OFFSET ?
+            """,
+            (match, user or ANONYMOUS, limit + 1, cursor)
+        )
+        rows = c.fetchall()
+        results = [
+            {"msg_id": i, "chat_id": cid, "role": r, "title": t, "snippet": snip, "rank": rank}
+            for i, cid, r, t, snip, rank in rows[:limit]
+        ]
+        return results, (cursor + limit if len(rows) > limit else None)
+
+    def backfill_search_index(self, batch_size: int = 5000, max_batches: int = None) -> int:
+        """
+        Indexes messages written before the search index existed, in small
+        transactions so writers are never blocked for long. Resumable; returns
+        the number of rows indexed by this call.
+        """
+        self.flush()
+        meta = dict(self.db.reader().execute("SELECT key, value FROM meta WHERE key LIKE 'fts_backfill_%'"))
+        upto, done = int(meta["fts_backfill_upto"]), int(meta["fts_backfill_done"])
+        indexed = batches = 0
+        while done < upto and (max_batches is None or batches < max_batches):
+            # One short write transaction per batch; the writer lock is released in between
+            with self.db.write() as conn:
+                rows = conn.execute(
+                    "SELECT msg_id, content FROM messages WHERE msg_id > ? AND msg_id <= ? "
+                    "AND role != 'assistant_think' ORDER BY msg_id LIMIT ?",
+                    (done, upto, batch_size)
+                ).fetchall()
+                conn.executemany("INSERT INTO messages_fts(rowid, content) VALUES (?, ?)", rows)
+                done = rows[-1][0] if len(rows) == batch_size else upto
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'fts_backfill_done'", (done,))
+            indexed += len(rows)
+            batches += 1
+        if indexed:
+            logger.info(f"Search backfill indexed {indexed} messages")
+        return indexed
+
+    def compress_existing(self, batch_size: int = 500, max_batches: int = None) -> int:
+        """
+        Compresses large messages written before compression was enabled,
+        one short transaction per batch. Resumable (progress is kept in meta);
+        returns the number of rows rewritten by this call.
+        """
+        if codec.CODEC is None:
+            return 0
+        self.flush()
+        row = self.db.reader().execute("SELECT value FROM meta WHERE key = 'compress_done'").fetchone()
+        done = int(row[0]) if row else 0
+        roles = ",".join("?" * len(codec.COMPRESSIBLE_ROLES))
+        rewritten = batches = 0
+        while max_batches is None or batches < max_batches:
+            with self.db.write() as conn:
+                rows = conn.execute(
+                    f"SELECT msg_id, role, content FROM messages WHERE msg_id > ? AND role IN ({roles}) "
+                    "AND codec IS NULL AND length(CAST(content AS BLOB)) >= ? ORDER BY msg_id LIMIT ?",
+                    (done, *codec.COMPRESSIBLE_ROLES, codec.COMPRESS_MIN_BYTES, batch_size)
+                ).fetchall()
+                updates = []
+                for msg_id, role, content in rows:
+                    text, body, tag, raw_size = codec.encode(role, content)
+                    if tag is not None:
+                        updates.append((body, tag, raw_size, msg_id))
+                conn.executemany(
+                    "UPDATE messages SET content = NULL, body = ?, codec = ?, raw_size = ? WHERE msg_id = ?",
+                    updates
+                )
+                if len(rows) == batch_size:
+                    done = rows[-1][0]
+                else:
+                    done = conn.execute("SELECT COALESCE(MAX(msg_id), 0) FROM messages").fetchone()[0]
+                conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('compress_done', ?)", (done,))
+            rewritten += len(updates)
+            batches += 1
+            if len(rows) < batch_size:
+                break
+        if rewritten:
+            logger.info(f"Compressed {rewritten} stored messages")
+        return rewritten
+
+    def compression_report(self) -> dict:
+        """Space used by compressed bodies versus their original size, per codec and in total."""
+        self.flush()
+        rows = self.db.reader().execute(
+            "SELECT codec, COUNT(*), SUM(raw_size), SUM(length(body)) FROM messages "
+            "WHERE codec IS NOT NULL GROUP BY codec"
+        ).fetchall()
+        codecs = {k: {"rows": n, "raw_bytes": raw, "stored_bytes": stored} for k, n, raw, stored in rows}
+        raw    = sum(c["raw_bytes"] for c in codecs.values())
+        stored = sum(c["stored_bytes"] for c in codecs.values())
+        return {
+            "codecs":       codecs,
+            "rows":         sum(c["rows"] for c in codecs.values()),
+            "raw_bytes":    raw,
+            "stored_bytes": stored,
+            "saved_bytes":  raw - stored,
+            "ratio":        raw / stored if stored else None,
+        }
+
+    # --- archive ---
+
+    def _archive_path(self, month: str) -> str:
+        base, _ = os.path.splitext(os.path.basename(self.db_path))
+        return os.path.join(ARCHIVE_DIR or os.path.dirname(self.db_path), f"{base}-archive-{month}.db")
+
+    @contextmanager
+    def _attached(self, conn: sqlite3.Connection, month: str):
+        """
+        The month's archive file attached to the writer connection as `arc`,
+        with a messages table matching the live one. The caller commits
+        before leaving the block, since SQLite cannot detach mid-transaction.
+        """
+        conn.execute("ATTACH DATABASE ? AS arc", (self._archive_path(month),))
         try:
-            self.conn.close()
-        except:
-            pass
+            conn.execute("PRAGMA arc.journal_mode=WAL;")
+            cols = [(name, ctype) for _, name, ctype, *_ in conn.execute("PRAGMA main.table_info(messages)")]
+            have = {row[1] for row in conn.execute("PRAGMA arc.table_info(messages)")}
+            if not have:
+                defs = ", ".join(f"{n} {t}" + (" PRIMARY KEY" if n == "msg_id" else "") for n, t in cols)
+                conn.execute(f"CREATE TABLE arc.messages ({defs});")
+                conn.execute("CREATE INDEX arc.idx_archive_chat ON messages(chat_id, msg_id);")
+            for n, t in cols:
+                # Columns added to messages after this archive was created
+                if have and n not in have:
+                    conn.execute(f"ALTER TABLE arc.messages ADD COLUMN {n} {t};")
+            yield ", ".join(n for n, _ in cols)
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("DETACH DATABASE arc")
+
+    def _ensure_hot(self, chat_id: str) -> None:
+        """Restores `chat_id` from its archive if it was archived. One primary-key lookup otherwise."""
+        row = self.db.reader().execute("SELECT archived FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row and row[0]:
+            self.restore_chat(chat_id)
+
+    def archive_idle_chats(self, days: float = ARCHIVE_AFTER_DAYS, batch_size: int = 50,
+                           max_batches: int = None) -> int:
+        """
+        Moves the messages of chats with no activity for `days` into monthly
+        archive files (by chat creation month), `batch_size` chats per short
+        transaction so writers only ever wait for one batch. Each batch is
+        copied, committed, then deleted from the live tables, so a crash in
+        between leaves a duplicate, never a loss. Returns chats archived.
+        """
+        if days <= 0:
+            return 0
+        self.flush()
+        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        reader = self.db.reader()
+        idle, after = [], ("", "")
+        while max_batches is None or len(idle) < batch_size * max_batches:
+            # Oldest first; last activity is the newest message's timestamp (an index seek per chat)
+            rows = reader.execute(
+                "SELECT chat_id, created_at FROM chats WHERE archived IS NULL AND created_at < ? "
+                "AND (restored_at IS NULL OR restored_at < ?) "
+                "AND (created_at, chat_id) > (?, ?) ORDER BY created_at, chat_id LIMIT ?",
+                (cutoff, cutoff, *after, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            for chat_id, created_at in rows:
+                last = reader.execute(
+                    "SELECT timestamp FROM messages WHERE chat_id = ? ORDER BY msg_id DESC LIMIT 1", (chat_id,)
+                ).fetchone()
+                if last is None or last[0] < cutoff:
+                    idle.append((chat_id, created_at[:7]))
+            after = rows[-1][1], rows[-1][0]
+        if max_batches is not None:
+            idle = idle[:batch_size * max_batches]
+
+        by_month = {}
+        for chat_id, month in idle:
+            by_month.setdefault(month, []).append(chat_id)
+        archived = 0
+        for month, chat_ids in sorted(by_month.items()):
+            for i in range(0, len(chat_ids), batch_size):
+                batch = chat_ids[i:i + batch_size]
+                marks = ",".join("?" * len(batch))
+                with span("archive_batch"), self.db.write() as conn, self._attached(conn, month) as cols:
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO arc.messages({cols}) "
+                        f"SELECT {cols} FROM main.messages WHERE chat_id IN ({marks})", batch
+                    )
+                    conn.commit()
+                with self.db.write() as conn:
+                    conn.execute(f"DELETE FROM messages WHERE chat_id IN ({marks})", batch)
+                    conn.execute(f"UPDATE chats SET archived = ? WHERE chat_id IN ({marks})", (month, *batch))
+                archived += len(batch)
+        if archived:
+            logger.info(f"Archived {archived} idle chats")
+        return archived
+
+    def restore_chat(self, chat_id: str) -> bool:
+        """Moves an archived chat's messages back into the live tables. Returns False if it was not archived."""
+        with self.db.write() as conn:
+            row = conn.execute("SELECT archived FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+            if not row or not row[0]:
+                return False
+            month = row[0]
+            with span("restore_chat"), self._attached(conn, month) as cols:
+                # msg_ids are kept; AUTOINCREMENT never hands out an archived id again
+                conn.execute(
+                    f"INSERT OR REPLACE INTO main.messages({cols}) "
+                    f"SELECT {cols} FROM arc.messages WHERE chat_id = ?", (chat_id,)
+                )
+                conn.execute(
+                    "UPDATE chats SET archived = NULL, restored_at = ? WHERE chat_id = ?",
+                    (datetime.utcnow().isoformat(), chat_id)
+                )
+                conn.commit()
+                conn.execute("DELETE FROM arc.messages WHERE chat_id = ?", (chat_id,))
+                conn.commit()
+        logger.info(f"Restored chat {chat_id} from archive {month}")
+        return True
+
+    # --- export / import ---
+
+    @staticmethod
+    def _message_filters(since: str, until: str, roles: list, exclude_roles: list, alias: str = "") -> tuple:
+        clauses, params = [], []
+        if since:
+            clauses.append(f"{alias}timestamp >= ?"); params.append(since)
+        if until:
+            clauses.append(f"{alias}timestamp < ?"); params.append(until)
+        if roles:
+            clauses.append(f"{alias}role IN ({','.join('?' * len(roles))})"); params += roles
+        if exclude_roles:
+            clauses.append(f"{alias}role NOT IN ({','.join('?' * len(exclude_roles))})"); params += exclude_roles
+        return "".join(f" AND {c}" for c in clauses), params
+
+    def iter_messages(self, owner: str = None, since: str = None, until: str = None, roles: list = None,
+                      exclude_roles: list = None, include_archived: bool = True, chunk_size: int = 5000):
+        """
+        Yields every message matching the filters as a dict (msg_id, chat_id,
+        owner, title, chat_created_at, role, content, timestamp), in chunks
+        of `chunk_size` keyset reads so memory stays constant and no read
+        transaction is held between chunks. `since`/`until` bound the message
+        timestamp (ISO strings, `until` exclusive); owner None means all owners.
+        Live messages come first in msg_id order, then each archive file's.
+        """
+        self.flush()
+        where, params = self._message_filters(since, until, roles, exclude_roles, alias="m.")
+        if owner is not None:
+            where += " AND ch.owner = ?"
+            params.append(owner)
+        reader, last = self.db.reader(), 0
+        while True:
+            rows = reader.execute(
+                "SELECT m.msg_id, m.chat_id, ch.owner, ch.title, ch.created_at, m.role, "
+                "m.content, m.body, m.codec, m.timestamp "
+                f"FROM messages m JOIN chats ch ON ch.chat_id = m.chat_id WHERE m.msg_id > ?{where} "
+                "ORDER BY m.msg_id LIMIT ?",
+                (last, *params, chunk_size)
+            ).fetchall()
+            for msg_id, chat_id, who, title, created, role, content, body, tag, ts in rows:
+                yield {"msg_id": msg_id, "chat_id": chat_id, "owner": who, "title": title,
+                       "chat_created_at": created, "role": role,
+                       "content": codec.decode(content, body, tag), "timestamp": ts}
+            if len(rows) < chunk_size:
+                break
+            last = rows[-1][0]
+        if include_archived:
+            yield from self._iter_archived(owner, since, until, roles, exclude_roles, chunk_size)
+
+    def _iter_archived(self, owner, since, until, roles, exclude_roles, chunk_size):
+        reader = self.db.reader()
+        months = [m for m, in reader.execute("SELECT DISTINCT archived FROM chats WHERE archived IS NOT NULL")]
+        where, params = self._message_filters(since, until, roles, exclude_roles)
+        for month in sorted(months):
+            path = self._archive_path(month)
+            if not os.path.exists(path):
+                logger.warning(f"Archive {path} is missing; skipping its messages")
+                continue
+            arc, last = sqlite3.connect(f"file:{path}?mode=ro", uri=True), 0
+            try:
+                while True:
+                    rows = arc.execute(
+                        "SELECT msg_id, chat_id, role, content, body, codec, timestamp FROM messages "
+                        f"WHERE msg_id > ?{where} ORDER BY msg_id LIMIT ?",
+                        (last, *params, chunk_size)
+                    ).fetchall()
+                    chat_ids = list({r[1] for r in rows})
+                    chats = {}
+                    for i in range(0, len(chat_ids), 500):
+                        part = chat_ids[i:i + 500]
+                        chats.update((r[0], r[1:]) for r in reader.execute(
+                            "SELECT chat_id, owner, title, created_at, archived FROM chats "
+                            f"WHERE chat_id IN ({','.join('?' * len(part))})", part
+                        ))
+                    for msg_id, chat_id, role, content, body, tag, ts in rows:
+                        who, title, created, archived = chats.get(chat_id, (None, None, None, None))
+                        # Leftovers of a chat restored since are served from the live tables
+                        if archived != month or (owner is not None and who != owner):
+                            continue
+                        yield {"msg_id": msg_id, "chat_id": chat_id, "owner": who, "title": title,
+                               "chat_created_at": created, "role": role,
+                               "content": codec.decode(content, body, tag), "timestamp": ts}
+                    if len(rows) < chunk_size:
+                        break
+                    last = rows[-1][0]
+            finally:
+                arc.close()
+
+    def import_messages(self, records, batch_size: int = 20000, keep_ids: bool = False) -> int:
+        """
+        Bulk-loads records shaped like iter_messages() output, `batch_size`
+        per transaction with executemany. Chats are created as needed (an
+        existing chat keeps its owner and title). msg_ids are reassigned
+        unless keep_ids, which replaces any row with the same id. Returns
+        the number of messages imported.
+        """
+        self.flush()
+        cols = "chat_id, role, content, timestamp, body, codec, raw_size"
+        sql = (f"INSERT INTO messages(msg_id, {cols}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)" if keep_ids
+               else f"INSERT INTO messages({cols}) VALUES (?, ?, ?, ?, ?, ?, ?)")
+        imported = 0
+
+        def commit(chats: dict, messages: list):
+            with span("import_batch"), self.db.write() as conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO chats(chat_id, created_at, title, owner) VALUES (?, ?, ?, ?)",
+                    [(cid, *meta) for cid, meta in chats.items()]
+                )
+                if keep_ids:
+                    # Not INSERT OR REPLACE: its implicit delete skips messages_fts_ad
+                    # (recursive_triggers is off) and leaves the old text in the index
+                    conn.executemany("DELETE FROM messages WHERE msg_id = ?", [(m[0],) for m in messages])
+                conn.executemany(sql, messages)
+
+        chats, messages = {}, []
+        for r in records:
+            chat_id = r["chat_id"]
+            if chat_id not in chats:
+                chats[chat_id] = (r.get("chat_created_at") or r.get("timestamp"), r.get("title"),
+                                  r.get("owner") or ANONYMOUS)
+            text, body, tag, raw_size = codec.encode(r["role"], r.get("content") or "")
+            row = (chat_id, r["role"], text, r.get("timestamp"), body, tag, raw_size)
+            messages.append((r["msg_id"], *row) if keep_ids else row)
+            if len(messages) >= batch_size:
+                commit(chats, messages)
+                imported += len(messages)
+                chats, messages = {}, []
+        if messages:
+            commit(chats, messages)
+            imported += len(messages)
+        logger.info(f"Imported {imported} messages")
+        return imported
+
+    def search_backfill_pending(self) -> bool:
+        row = self.db.reader().execute(
+            # meta.value is TEXT: compare as numbers, not strings ('7000' > '60000')
+            "SELECT (SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'fts_backfill_done') "
+            "     < (SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'fts_backfill_upto')"
+        ).fetchone()
+        return bool(row[0])
+
+    def start_search_backfill(self) -> threading.Thread | None:
+        """Runs backfill_search_index on a daemon thread if there is anything left to index."""
+        if not self.search_backfill_pending():
+            return None
+        t = threading.Thread(target=self.backfill_search_index, name="fts-backfill", daemon=True)
+        t.start()
+        return t
+
+    def close(self):
+        # The Database is shared process-wide and stays open; only this manager's queue stops.
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(db_path: str = None) -> StorageManager:
+    """Process-wide StorageManager for `db_path` (default CHAT_DB_PATH), shared by every ChatClient."""
+    db = get_database(db_path)
+    with _storages_lock:
+        storage = _storages.get(db.path)
+        if storage is None:
+            storage = _storages[db.path] = StorageManager(db.path)
+            storage.maintenance.start()
+        return storage
@@ -0,0 +1,94 @@
+from typing import List, Tuple
+
+THINK_OPEN  = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag_len(text: str, tag: str) -> int:
+    """Length of the longest suffix of `text` that is a proper prefix of `tag`."""
+    for n in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:n]):
+            return n
+    return 0
+
+
+class ThinkParser:
+    """
+    Incremental splitter for <think>...</think> reasoning in a token stream.
+
+    feed() takes each delta as it arrives and returns a list of events:
+      ("think", text)   - reasoning text
+      ("answer", text)  - answer text
+      ("think_end", "") - a reasoning block just closed
+    Work per delta is proportional to the delta; only a possible partial tag
+    (at most len("</think>") - 1 chars) is held back between calls, so a tag
+    split across SSE deltas is still recognised.
+    """
+    def __init__(self):
+        self.in_think   = False
+        self.saw_think  = False
+        self._pending   = ""
+        self._reasoning = []
+        self._answer    = []
+
+    def feed(self, delta: str) -> List[Tuple[str, str]]:
+        events = []
+        buf = self._pending + delta if self._pending else delta
+        self._pending = ""
+        while buf:
+            tag = THINK_CLOSE if self.in_think else THINK_OPEN
+            idx = buf.find(tag)
+            if idx < 0:
+                hold = _partial_tag_len(buf, tag)
+                if hold:
+                    self._pending, buf = buf[-hold:], buf[:-hold]
+                self._emit(events, buf)
+                break
+            self._emit(events, buf[:idx])
+            buf = buf[idx + len(tag):]
+            if self.in_think:
+                events.append(("think_end", ""))
+            self.in_think  = not self.in_think
+            self.saw_think = True
+        return events
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """Releases any held-back bytes at end of stream."""
+        events = []
+        pending, self._pending = self._pending, ""
+        self._emit(events, pending)
+        return events
+
+    def _emit(self, events: list, text: str) -> None:
+        if not text:
+            return
+        if self.in_think:
+            self._reasoning.append(text)
+            events.append(("think", text))
+        else:
+            self._answer.append(text)
+            events.append(("answer", text))
+
+    @property
+    def reasoning(self) -> str:
+        return "".join(self._reasoning)
+
+    @property
+    def answer(self) -> str:
+        return "".join(self._answer)
+
+    def reset_reasoning(self) -> None:
+        """Drops accumulated reasoning (after it has been persisted)."""
+        self._reasoning = []
+
+
+def split_think(text: str) -> Tuple[str | None, str]:
+    """
+    One-shot split of a complete response into (reasoning, answer).
+    reasoning is None when the response has no <think> block.
+    """
+    parser = ThinkParser()
+    parser.feed(text)
+    parser.flush()
+    reasoning = parser.reasoning.strip() if parser.saw_think else None
+    return reasoning, parser.answer.strip()
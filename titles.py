@@ -0,0 +1,68 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+TITLE_MODEL       = "llama3.2:3b"
+TITLE_WORKERS     = int(os.getenv("TITLE_WORKERS", "2"))
+TITLE_MAX_PENDING = int(os.getenv("TITLE_MAX_PENDING", "16"))
+
+# Shared by every ChatClient in the process so the bound is global, not per session.
+_executor = ThreadPoolExecutor(max_workers=TITLE_WORKERS, thread_name_prefix="title")
+_slots    = threading.BoundedSemaphore(TITLE_MAX_PENDING)
+
+
+def local_title(prompt: str, max_words: int = 5, max_len: int = 40) -> str:
+    """Derives a title from the prompt itself: the first few words, capitalised."""
+    words = re.findall(r"[\w'’-]+", prompt)[:max_words]
+    if not words:
+        return "Chat"
+    title = " ".join(words)
+    if len(title) > max_len:
+        title = title[:max_len].rsplit(" ", 1)[0]
+    return title[0].upper() + title[1:]
+
+
+class TitleGenerator:
+    """
+    Generates chat titles off the request path.
+
+    submit() schedules `generate(prompt)` on a bounded executor and writes the
+    result through storage.set_chat_title. When the queue is full, or the
+    backend call fails, the title is derived locally from the prompt instead.
+    """
+    def __init__(self, generate: Callable[[str, str], str], storage, model: str = TITLE_MODEL):
+        self.generate = generate
+        self.storage  = storage
+        self.model    = model
+
+    def submit(self, chat_id: str, prompt: str) -> Future:
+        if not _slots.acquire(blocking=False):
+            logger.info("Title queue full; using local title")
+            fut = Future()
+            fut.set_result(self._store(chat_id, local_title(prompt)))
+            return fut
+        try:
+            return _executor.submit(self._run, chat_id, prompt)
+        except RuntimeError:
+            # Executor shut down (interpreter exit)
+            _slots.release()
+            raise
+
+    def _run(self, chat_id: str, prompt: str) -> str:
+        try:
+            title = self.generate(prompt, self.model)
+        except Exception as e:
+            logger.warning(f"Failed to generate title: {e}")
+            title = local_title(prompt)
+        finally:
+            _slots.release()
+        return self._store(chat_id, title or local_title(prompt))
+
+    def _store(self, chat_id: str, title: str) -> str:
+        self.storage.set_chat_title(chat_id, title)
+        return title
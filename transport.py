@@ -0,0 +1,81 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+POOL_CONNECTIONS = int(os.getenv("OLLAMA_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE     = int(os.getenv("OLLAMA_POOL_MAXSIZE", "32"))
+# Longest a caller waits for a free connection once all POOL_MAXSIZE are in use
+POOL_TIMEOUT     = float(os.getenv("OLLAMA_POOL_TIMEOUT", "30"))
+
+
+class _BoundedWait:
+    # requests never passes pool_timeout to urlopen, so a blocking pool would
+    # otherwise wait forever behind long-running streams
+    def urlopen(self, *args, **kwargs):
+        kwargs.setdefault("pool_timeout", POOL_TIMEOUT)
+        return super().urlopen(*args, **kwargs)
+
+
+class _HTTPPool(_BoundedWait, HTTPConnectionPool):
+    pass
+
+
+class _HTTPSPool(_BoundedWait, HTTPSConnectionPool):
+    pass
+
+
+class _PoolAdapter(HTTPAdapter):
+    """HTTPAdapter whose blocking pools give up after POOL_TIMEOUT with requests.ConnectionError."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPPool, "https": _HTTPSPool}
+
+    def send(self, request, *args, **kwargs):
+        try:
+            return super().send(request, *args, **kwargs)
+        except EmptyPoolError as e:
+            raise requests.ConnectionError(e, request=request)
+
+
+class HTTPTransport:
+    """
+    Keep-alive HTTP transport for the Ollama backend.
+
+    Wraps one requests.Session with a sized connection pool, so TCP/TLS setup
+    is paid once per connection instead of once per request. Sessions are
+    thread-safe for this usage (one request per call, no shared cookies).
+    """
+    def __init__(self, url: str, pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE):
+        self.url     = url.rstrip("/")
+        self.session = requests.Session()
+        # pool_block=True makes callers wait (up to POOL_TIMEOUT) for a free
+        # connection instead of opening throwaway ones once the pool is exhausted.
+        adapter = _PoolAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, path: str, payload: dict, stream: bool = False, timeout: float = 300) -> requests.Response:
+        return self.session.post(f"{self.url}{path}", json=payload, stream=stream, timeout=timeout)
+
+    def get(self, path: str, timeout: float = 10) -> requests.Response:
+        return self.session.get(f"{self.url}{path}", timeout=timeout)
+
+    def close(self):
+        self.session.close()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(url: str) -> HTTPTransport:
+    """Process-wide transport per backend URL, shared across ChatClients and Streamlit sessions."""
+    url = url.rstrip("/")
+    with _transports_lock:
+        transport = _transports.get(url)
+        if transport is None:
+            transport = _transports[url] = HTTPTransport(url)
+        return transport
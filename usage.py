@@ -0,0 +1,49 @@
+"""
+Daily token quotas.
+
+Token counts and generation time are stored with each assistant message and
+summed per UTC day, owner and model in usage_daily (see StorageManager).
+Once an owner's prompt + completion tokens for today reach their quota, new
+requests are refused with QuotaExceeded before anything is sent.
+
+Logged-out visitors share the "anonymous" owner and its quota: a browser
+session id would reset with every new tab, so it cannot hold a limit. Give
+that pool its own quota with an "anonymous=" override.
+
+    USAGE_DAILY_TOKENS=200000                                   # everyone; 0 = unlimited
+    USAGE_USER_TOKENS="alice@example.com=1000000,anonymous=20000"  # per-owner overrides
+"""
+import os
+
+USAGE_DAILY_TOKENS = int(os.getenv("USAGE_DAILY_TOKENS", "0"))
+USAGE_USER_TOKENS  = os.getenv("USAGE_USER_TOKENS", "")
+
+
+class QuotaExceeded(RuntimeError):
+    """Raised before a request is sent when its owner is over their daily token quota."""
+
+
+def _parse_quotas(spec: str) -> dict:
+    quotas = {}
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        owner, _, n = entry.rpartition("=")
+        quotas[owner] = int(n)
+    return quotas
+
+
+_USER_QUOTAS = _parse_quotas(USAGE_USER_TOKENS)
+
+
+def daily_quota(owner: str) -> int:
+    """Tokens `owner` may use per UTC day; 0 = unlimited."""
+    return _USER_QUOTAS.get(owner, USAGE_DAILY_TOKENS)
+
+
+def check_quota(storage, owner: str) -> None:
+    """Raises QuotaExceeded if `owner` has used up today's quota."""
+    quota = daily_quota(owner)
+    if not quota:
+        return
+    used = storage.tokens_used(owner)
+    if used >= quota:
+        raise QuotaExceeded(f"Daily limit of {quota} tokens reached ({used} used); it resets at 00:00 UTC.")